@@ -11,4 +11,6 @@ fi
 NUM_WORKERS=3
 TIMEOUT=120
 
+python -m src.migrations upgrade || exit 1
+
 python src/main.py
\ No newline at end of file
@@ -1,14 +1,17 @@
-from fastapi import APIRouter, Depends, status, Request, Query, HTTPException, Path
+from fastapi import APIRouter, Depends, status, Request, Query, HTTPException, Path, Header
 from fastapi.security import OAuth2PasswordBearer
-from fastapi.responses import JSONResponse
+from fastapi.responses import Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from redis.asyncio import Redis
 
 from src.db.postgres import get_db_session
 from src.db.redis import get_redis
-from src.services.promo import PromoService
+from src.core.serialization import json_response
+from src.core.streaming import stream_format, streaming_response
+from src.services.promo import PromoService, etag_service
 from src.services.company import CompanyService
 from src.services.user import UserService
+from src.services.idempotency import IdempotencyService
 
 oauth2_scheme_company = OAuth2PasswordBearer(tokenUrl="/api/business/auth/sign-in")
 oauth2_scheme_user = OAuth2PasswordBearer(tokenUrl="/api/user/auth/sign-in")
@@ -18,6 +21,24 @@ router = APIRouter()
 promo_service = PromoService()
 company_service = CompanyService()
 user_service = UserService()
+idempotency_service = IdempotencyService()
+
+
+def conditional_response(content, etag: str, if_none_match: str | None, headers: dict | None = None) -> Response:
+    """
+    Ответ с ETag; при совпадении с If-None-Match тело не передается (304)
+    """
+    headers = {**(headers or {}), "ETag": etag}
+    if etag_service.matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return json_response(content, headers=headers)
+
+
+def total_count_header(total_count: int | None) -> dict:
+    """
+    Заголовок X-Total-Count; на страницах по курсору общее количество не считается и заголовок не отправляется
+    """
+    return {"X-Total-Count": str(total_count)} if total_count is not None else {}
 
 
 @router.post(
@@ -27,11 +48,12 @@ user_service = UserService()
 async def create_promo(
     request: Request,
     token: str = Depends(oauth2_scheme_company),
+    redis: Redis = Depends(get_redis),
     db: AsyncSession = Depends(get_db_session),
 ):
     body = await request.json()
     company_id = await company_service.validate_token(token)
-    return await promo_service.promo_create(body, db, company_id)
+    return await promo_service.promo_create(body, db, redis, company_id)
 
 
 @router.get(
@@ -45,9 +67,14 @@ async def list_promos(
     sort_by: str | None = Query(None, regex="^(active_from|active_until|created_at)$", description="Сортировка по active_from, active_until или created_at"),
     offset: int = Query(0, ge=0, description="Смещение для пагинации"),
     limit: int = Query(10, gt=0, description="Количество записей для пагинации"),
+    cursor: str | None = Query(None, description="Курсор следующей страницы из заголовка X-Next-Cursor"),
+    accept: str | None = Header(None),
 ):
     """
     Получение списка промокодов с фильтрацией, сортировкой и пагинацией.
+    Страницы листаются курсором из заголовка X-Next-Cursor; offset поддерживается для совместимости.
+    X-Total-Count передается только на страницах без курсора.
+    С заголовком Accept: application/x-ndjson или application/json; stream=true список отдается потоком.
     """
     company_id = await company_service.validate_token(token)
 
@@ -56,15 +83,48 @@ async def list_promos(
         "sort_by": sort_by,
         "offset": offset,
         "limit": limit,
+        "cursor": cursor,
     }
 
+    if fmt := stream_format(accept):
+        total_count, next_cursor, promos = await promo_service.promo_get_list_stream(company_id, params)
+        headers = total_count_header(total_count)
+        if next_cursor:
+            headers["X-Next-Cursor"] = next_cursor
+        return streaming_response(promos, fmt, headers)
+
     result = await promo_service.promo_get_list(db, company_id, params)
 
     total_count = result["total_count"]
     promos = result["promos"]
 
-    headers = {"X-Total-Count": str(total_count)}
-    return JSONResponse(content=promos, headers=headers)
+    headers = total_count_header(total_count)
+    if result["next_cursor"]:
+        headers["X-Next-Cursor"] = result["next_cursor"]
+    return json_response(promos, headers=headers)
+
+
+@router.patch(
+    "/business/promo",
+    status_code=status.HTTP_200_OK,
+)
+async def bulk_update_promos(
+    request: Request,
+    token: str = Depends(oauth2_scheme_company),
+    redis: Redis = Depends(get_redis),
+    db: AsyncSession = Depends(get_db_session),
+):
+    """
+    Пакетное редактирование промокодов: список частичных изменений с полем id.
+    Возвращает результат (status_code и detail при ошибке) по каждому элементу в порядке запроса
+    """
+    try:
+        body = await request.json()
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid or missing JSON in the request body.")
+
+    company_id = await company_service.validate_token(token)
+    return json_response(await promo_service.promo_bulk_update(body, db, redis, company_id))
 
 
 @router.get(
@@ -74,10 +134,20 @@ async def list_promos(
 async def get_promo_by_id(
     promo_id: str,
     token: str = Depends(oauth2_scheme_company),
-    db: AsyncSession = Depends(get_db_session)
+    redis: Redis = Depends(get_redis),
+    db: AsyncSession = Depends(get_db_session),
+    if_none_match: str | None = Header(None, alias="If-None-Match"),
     ):
     company_id = await company_service.validate_token(token)
-    return await promo_service.promo_get_by_id(promo_id, db, company_id)
+
+    # Неизмененный промокод подтверждается по ETag из Redis без обращения к базе
+    if if_none_match:
+        etag = await etag_service.get(promo_id, "detail", redis, company_id=company_id)
+        if etag_service.matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    promo, etag = await promo_service.promo_get_by_id(promo_id, db, redis, company_id)
+    return conditional_response(promo, etag, if_none_match)
 
 
 @router.patch(
@@ -88,6 +158,7 @@ async def update_promo(
     promo_id: str,
     request: Request,
     token: str = Depends(oauth2_scheme_company),
+    redis: Redis = Depends(get_redis),
     db: AsyncSession = Depends(get_db_session)
     ):
     try:
@@ -98,7 +169,7 @@ async def update_promo(
     if not body:
         raise HTTPException(status_code=400, detail="Request body cannot be empty.")
     company_id = await company_service.validate_token(token)
-    return await promo_service.promo_update(promo_id, body, db, company_id)
+    return await promo_service.promo_update(promo_id, body, db, redis, company_id)
 
 
 @router.get(
@@ -108,18 +179,34 @@ async def update_promo(
 async def user_promo_feed(
     token: str = Depends(oauth2_scheme_user),
     db: AsyncSession = Depends(get_db_session),
+    redis: Redis = Depends(get_redis),
     country: str = None,
-    search: str = None
+    search: str = None,
+    limit: int = Query(10, gt=0, le=100, description="Количество записей на странице"),
+    cursor: str | None = Query(None, description="Курсор следующей страницы из заголовка X-Next-Cursor"),
+    accept: str | None = Header(None),
     ):
 
     user_id = await user_service.validate_token(token)
 
-    result = await promo_service.promo_user_get_list(db, user_id, country=country, search=search)
-    total_count = result["total_count"]
-    promos = result["promos"]
+    # Потоковая выдача читает базу напрямую в собственной сессии, минуя кеш страниц
+    if fmt := stream_format(accept):
+        total_count, next_cursor, promos = await promo_service.promo_user_get_feed_stream(
+            redis, user_id, country=country, search=search, limit=limit, cursor=cursor,
+        )
+        headers = total_count_header(total_count)
+        if next_cursor:
+            headers["X-Next-Cursor"] = next_cursor
+        return streaming_response(promos, fmt, headers)
+
+    page = await promo_service.promo_user_get_feed(
+        db, redis, user_id, country=country, search=search, limit=limit, cursor=cursor,
+    )
 
-    headers = {"X-Total-Count": str(total_count)}
-    return JSONResponse(content=promos, headers=headers)
+    headers = total_count_header(page.total_count)
+    if page.next_cursor:
+        headers["X-Next-Cursor"] = page.next_cursor
+    return Response(content=page.body, media_type="application/json", headers=headers)
 
 
 @router.get(
@@ -131,7 +218,7 @@ async def promo_history(
     db: AsyncSession = Depends(get_db_session),
     ):
     user_id = await user_service.validate_token(token)
-    return await promo_service.promo_history(user_id, db)
+    return json_response(await promo_service.promo_history(user_id, db))
 
 
 @router.get(
@@ -141,10 +228,19 @@ async def promo_history(
 async def get_user_promo_by_id(
     promo_id: str,
     token: str = Depends(oauth2_scheme_user),
+    redis: Redis = Depends(get_redis),
     db: AsyncSession = Depends(get_db_session),
+    if_none_match: str | None = Header(None, alias="If-None-Match"),
     ):
     user_id = await user_service.validate_token(token)
-    return await promo_service.promo_user_get_by_id(promo_id, db, user_id)
+
+    if if_none_match:
+        etag = await etag_service.get(promo_id, f"card:{user_id}", redis)
+        if etag_service.matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    promo, etag = await promo_service.promo_user_get_by_id(promo_id, db, redis, user_id)
+    return conditional_response(promo, etag, if_none_match)
 
 
 @router.post(
@@ -154,10 +250,11 @@ async def get_user_promo_by_id(
 async def like_promo(
     promo_id: str,
     token: str = Depends(oauth2_scheme_user),
+    redis: Redis = Depends(get_redis),
     db: AsyncSession = Depends(get_db_session),
     ):
     user_id = await user_service.validate_token(token)
-    return await promo_service.promo_like_create(promo_id, user_id, db)
+    return await promo_service.promo_like_create(promo_id, user_id, db, redis)
 
 
 @router.delete(
@@ -166,10 +263,11 @@ async def like_promo(
 async def unlike_promo(
     promo_id: str,
     token: str = Depends(oauth2_scheme_user),
+    redis: Redis = Depends(get_redis),
     db: AsyncSession = Depends(get_db_session),
     ):
     user_id = await user_service.validate_token(token)
-    return await promo_service.promo_like_delete(promo_id, user_id, db)
+    return await promo_service.promo_like_delete(promo_id, user_id, db, redis)
 
 
 @router.post(
@@ -180,11 +278,12 @@ async def add_comment(
     promo_id: str,
     request: Request,
     token: str = Depends(oauth2_scheme_user),
+    redis: Redis = Depends(get_redis),
     db: AsyncSession = Depends(get_db_session),
     ):
     body = await request.json()
     user_id = await user_service.validate_token(token)
-    return await promo_service.promo_comment_create(promo_id, user_id, body, db)
+    return await promo_service.promo_comment_create(promo_id, user_id, body, db, redis)
 
 
 @router.get(
@@ -194,10 +293,27 @@ async def add_comment(
 async def get_comments(
     promo_id: str,
     token: str = Depends(oauth2_scheme_user),
+    redis: Redis = Depends(get_redis),
     db: AsyncSession = Depends(get_db_session),
+    limit: int = Query(10, gt=0, le=100, description="Количество комментариев на странице"),
+    cursor: str | None = Query(None, description="Курсор следующей страницы из заголовка X-Next-Cursor"),
+    if_none_match: str | None = Header(None, alias="If-None-Match"),
     ):
+    """
+    Получение комментариев к промокоду от новых к старым.
+    Страницы листаются курсором из заголовка X-Next-Cursor
+    """
     user_id = await user_service.validate_token(token)
-    return await promo_service.promo_comment_get_all(promo_id, db)
+
+    # В 304 заголовок X-Next-Cursor не передается: клиент использует курсор из сохраненного ответа
+    if if_none_match:
+        etag = await etag_service.get(promo_id, f"comments:{limit}:{cursor or ''}", redis)
+        if etag_service.matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    comments, next_cursor, etag = await promo_service.promo_comment_get_all(promo_id, db, redis, limit, cursor)
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return conditional_response(comments, etag, if_none_match, headers)
 
 
 @router.get(
@@ -211,7 +327,7 @@ async def get_comment_by_id(
     db: AsyncSession = Depends(get_db_session),
     ):
     user_id = await user_service.validate_token(token)
-    return await promo_service.promo_comment_get_by_id(promo_id, comment_id, db)
+    return json_response(await promo_service.promo_comment_get_by_id(promo_id, comment_id, db))
 
 
 @router.patch(
@@ -223,11 +339,12 @@ async def update_comment(
     comment_id: str,
     request: Request,
     token: str = Depends(oauth2_scheme_user),
+    redis: Redis = Depends(get_redis),
     db: AsyncSession = Depends(get_db_session),
     ):
     body = await request.json()
     user_id = await user_service.validate_token(token)
-    return await promo_service.promo_comment_update(promo_id, comment_id, user_id, body, db)
+    return await promo_service.promo_comment_update(promo_id, comment_id, user_id, body, db, redis)
 
 
 @router.delete(
@@ -238,10 +355,11 @@ async def delete_comment(
     promo_id: str,
     comment_id: str,
     token: str = Depends(oauth2_scheme_user),
+    redis: Redis = Depends(get_redis),
     db: AsyncSession = Depends(get_db_session),
     ):
     user_id = await user_service.validate_token(token)
-    return await promo_service.promo_comment_delete(promo_id, comment_id, user_id, db)
+    return await promo_service.promo_comment_delete(promo_id, comment_id, user_id, db, redis)
 
 
 @router.post(
@@ -253,9 +371,19 @@ async def activate_promo(
     token: str = Depends(oauth2_scheme_user),
     redis: Redis = Depends(get_redis),
     db: AsyncSession = Depends(get_db_session),
+    idempotency_key: str | None = Header(None, alias="Idempotency-Key"),
     ):
     user_id = await user_service.validate_token(token)
-    return await promo_service.promo_activate(promo_id, db, redis, user_id)
+    if not idempotency_key:
+        return await promo_service.promo_activate(promo_id, db, redis, user_id)
+
+    # Повторные запросы с тем же ключом получают первый ответ без повторной активации
+    return await idempotency_service.execute(
+        f"activate:{user_id}:{promo_id}",
+        idempotency_key,
+        redis,
+        lambda: promo_service.promo_activate(promo_id, db, redis, user_id),
+    )
 
 
 @router.get(
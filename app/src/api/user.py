@@ -4,8 +4,10 @@ from fastapi import APIRouter, Depends, HTTPException, status, Body
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel, HttpUrl
 from sqlalchemy.ext.asyncio import AsyncSession
+from redis.asyncio import Redis
 
 from src.db.postgres import get_db_session
+from src.db.redis import get_redis
 from src.services.promo import PromoService
 from src.services.company import CompanyService
 from src.services.user import UserService
@@ -24,9 +26,10 @@ router = APIRouter()
         )
 async def user_sign_up(
     request: dict,
+    redis: Redis = Depends(get_redis),
     db: AsyncSession = Depends(get_db_session),
     ):
-    return await user_service.sign_up(request, db)
+    return await user_service.sign_up(request, db, redis)
 
 
 @router.post(
@@ -51,10 +54,11 @@ async def user_sign_in(
         )
 async def get_profile(
     token: str = Depends(oauth2_scheme_user),
+    redis: Redis = Depends(get_redis),
     db: AsyncSession = Depends(get_db_session),
     ):
     user_id = await user_service.validate_token(token)
-    return await user_service.profile_get(user_id, db)
+    return await user_service.profile_get(user_id, db, redis)
 
 
 @router.patch(
@@ -64,7 +68,8 @@ async def get_profile(
 async def update_profile(
     request: dict,
     token: str = Depends(oauth2_scheme_user),
+    redis: Redis = Depends(get_redis),
     db: AsyncSession = Depends(get_db_session),
     ):
     user_id = await user_service.validate_token(token)
-    return await user_service.profile_update(user_id, request, db)
\ No newline at end of file
+    return await user_service.profile_update(user_id, request, db, redis)
\ No newline at end of file
@@ -44,14 +44,149 @@ class JWTSettings(BaseSettings):
     token_expire_time: int = Field(default=60)
 
 
+class CapacitySettings(BaseSettings):
+    """
+    Конфигурация счетчиков вместимости COMMON промокодов в Redis
+    """
+    reconcile_interval: int = Field(alias='CAPACITY_RECONCILE_INTERVAL', default=60)
+    key_ttl: int = Field(alias='CAPACITY_KEY_TTL', default=86400)
+
+
+class CountersSettings(BaseSettings):
+    """
+    Конфигурация счетчиков лайков, комментариев и активаций промокодов
+    """
+    reconcile_interval: int = Field(alias='COUNTERS_RECONCILE_INTERVAL', default=600)
+
+
+class CodePoolSettings(BaseSettings):
+    """
+    Конфигурация пула уникальных кодов UNIQUE промокодов
+    """
+    backend: str = Field(alias='CODE_POOL_BACKEND', default='postgres', pattern='^(postgres|redis)$')
+
+
+class ActivationWriterSettings(BaseSettings):
+    """
+    Конфигурация отложенной пакетной записи активаций промокодов
+    """
+    enabled: bool = Field(alias='ACTIVATION_WRITE_BEHIND', default=False)
+    batch_size: int = Field(alias='ACTIVATION_BATCH_SIZE', default=500)
+    flush_interval: float = Field(alias='ACTIVATION_FLUSH_INTERVAL', default=0.05)
+    claim_timeout: float = Field(alias='ACTIVATION_CLAIM_TIMEOUT', default=30)
+
+
+class LikeSettings(BaseSettings):
+    """
+    Конфигурация лайков: состояние в Redis с отложенной пакетной записью в базу
+    """
+    enabled: bool = Field(alias='LIKES_WRITE_BEHIND', default=False)
+    batch_size: int = Field(alias='LIKES_BATCH_SIZE', default=1000)
+    flush_interval: float = Field(alias='LIKES_FLUSH_INTERVAL', default=1.0)
+    max_flush_attempts: int = Field(alias='LIKES_MAX_FLUSH_ATTEMPTS', default=5)
+    key_ttl: int = Field(alias='LIKES_KEY_TTL', default=86400)
+
+
+class IdempotencySettings(BaseSettings):
+    """
+    Конфигурация обработки заголовка Idempotency-Key
+    """
+    ttl: int = Field(alias='IDEMPOTENCY_TTL', default=86400)
+    lock_ttl: int = Field(alias='IDEMPOTENCY_LOCK_TTL', default=30)
+    wait_timeout: float = Field(alias='IDEMPOTENCY_WAIT_TIMEOUT', default=10.0)
+    poll_interval: float = Field(alias='IDEMPOTENCY_POLL_INTERVAL', default=0.05)
+
+
+class AntifraudSettings(BaseSettings):
+    """
+    Конфигурация клиента антифрод-сервиса
+    """
+    address: str = Field(alias='ANTIFRAUD_ADDRESS', default='http://localhost:9090')
+    max_connections: int = Field(alias='ANTIFRAUD_MAX_CONNECTIONS', default=100)
+    max_keepalive_connections: int = Field(alias='ANTIFRAUD_MAX_KEEPALIVE_CONNECTIONS', default=20)
+    keepalive_expiry: float = Field(alias='ANTIFRAUD_KEEPALIVE_EXPIRY', default=30.0)
+    connect_timeout: float = Field(alias='ANTIFRAUD_CONNECT_TIMEOUT', default=1.0)
+    read_timeout: float = Field(alias='ANTIFRAUD_READ_TIMEOUT', default=2.0)
+    breaker_failure_threshold: int = Field(alias='ANTIFRAUD_BREAKER_FAILURE_THRESHOLD', default=5)
+    breaker_reset_timeout: float = Field(alias='ANTIFRAUD_BREAKER_RESET_TIMEOUT', default=30.0)
+    fail_open: bool = Field(alias='ANTIFRAUD_FAIL_OPEN', default=False)
+    local_cache_size: int = Field(alias='ANTIFRAUD_LOCAL_CACHE_SIZE', default=10000)
+    local_cache_ttl: float = Field(alias='ANTIFRAUD_LOCAL_CACHE_TTL', default=60.0)
+    prefetch: bool = Field(alias='ANTIFRAUD_PREFETCH', default=False)
+    prefetch_concurrency: int = Field(alias='ANTIFRAUD_PREFETCH_CONCURRENCY', default=20)
+
+
+class TargetingSettings(BaseSettings):
+    """
+    Конфигурация кеша скомпилированного таргетинга промокодов
+    """
+    cache_size: int = Field(alias='TARGETING_CACHE_SIZE', default=10000)
+    cache_ttl: float = Field(alias='TARGETING_CACHE_TTL', default=3600.0)
+
+
+class ProfileCacheSettings(BaseSettings):
+    """
+    Конфигурация кеша профилей пользователей
+    """
+    redis_ttl: int = Field(alias='PROFILE_CACHE_TTL', default=3600)
+    local_ttl: float = Field(alias='PROFILE_CACHE_LOCAL_TTL', default=60.0)
+    local_size: int = Field(alias='PROFILE_CACHE_LOCAL_SIZE', default=10000)
+
+
+class FeedIndexSettings(BaseSettings):
+    """
+    Конфигурация индекса активных промокодов в памяти воркера
+    """
+    enabled: bool = Field(alias='FEED_INDEX_ENABLED', default=False)
+    poll_interval: float = Field(alias='FEED_INDEX_POLL_INTERVAL', default=2.0)
+    poll_overlap: float = Field(alias='FEED_INDEX_POLL_OVERLAP', default=10.0)
+    timer_resolution: float = Field(alias='FEED_INDEX_TIMER_RESOLUTION', default=1.0)
+
+
+class FeedCacheSettings(BaseSettings):
+    """
+    Конфигурация кеша страниц ленты в Redis
+    """
+    enabled: bool = Field(alias='FEED_CACHE_ENABLED', default=True)
+    ttl: int = Field(alias='FEED_CACHE_TTL', default=30)
+
+
+class EtagSettings(BaseSettings):
+    """
+    Конфигурация ETag промокодов для условных GET-запросов (If-None-Match)
+    """
+    enabled: bool = Field(alias='ETAG_ENABLED', default=True)
+    ttl: int = Field(alias='ETAG_TTL', default=300)
+
+
+class ListingSettings(BaseSettings):
+    """
+    Конфигурация списков промокодов: точный подсчет общего количества (exact)
+    или оценка по плану запроса (estimated) для очень больших выборок
+    """
+    count_mode: str = Field(alias='LIST_COUNT_MODE', default='exact', pattern='^(exact|estimated)$')
+
+
 class Settings(BaseSettings):
     db: DBSettings = DBSettings()
     redis: RedisSettings = RedisSettings()
     jwt: JWTSettings = JWTSettings()
+    capacity: CapacitySettings = CapacitySettings()
+    counters: CountersSettings = CountersSettings()
+    code_pool: CodePoolSettings = CodePoolSettings()
+    activation_writer: ActivationWriterSettings = ActivationWriterSettings()
+    likes: LikeSettings = LikeSettings()
+    idempotency: IdempotencySettings = IdempotencySettings()
+    antifraud: AntifraudSettings = AntifraudSettings()
+    targeting: TargetingSettings = TargetingSettings()
+    profile_cache: ProfileCacheSettings = ProfileCacheSettings()
+    feed_index: FeedIndexSettings = FeedIndexSettings()
+    feed_cache: FeedCacheSettings = FeedCacheSettings()
+    etag: EtagSettings = EtagSettings()
+    listing: ListingSettings = ListingSettings()
     default_address: str = Field(alias='SERVER_ADDRESS', default='0.0.0.0:8080')
     default_host: str = '0.0.0.0'
     default_port: int = Field(alias='SERVER_PORT', default=8000)
-    antifraud: str = Field(alias='ANTIFRAUD_ADDRESS', default='http://localhost:9090')
 
 
 
@@ -0,0 +1,112 @@
+from datetime import datetime
+
+import orjson
+from fastapi.responses import ORJSONResponse
+
+from src.models.promo import Promo, PromoActivation, Comment
+
+
+def dumps(value) -> bytes:
+    """
+    Сериализация в JSON. UUID и даты orjson кодирует сам, в том же ISO-формате, что и FastAPI
+    """
+    return orjson.dumps(value)
+
+
+def loads(value: bytes):
+    return orjson.loads(value)
+
+
+def json_response(content, status_code: int = 200, headers: dict | None = None) -> ORJSONResponse:
+    """
+    Ответ, который сериализуется сразу в байты, минуя jsonable_encoder
+    """
+    return ORJSONResponse(content=content, status_code=status_code, headers=headers)
+
+
+def format_date(value: datetime | None) -> str | None:
+    return value.date().isoformat() if value else None
+
+
+def format_datetime(value: datetime | None) -> str | None:
+    return value.isoformat(sep=" ", timespec="seconds") if value else None
+
+
+def promo_card(promo: Promo) -> dict:
+    """
+    Карточка промокода для пользователя (лента и просмотр по id)
+    """
+    return {
+        "id": promo.id,
+        "description": promo.description,
+        "image_url": promo.image_url,
+        "target": promo.target,
+        "max_count": promo.max_count,
+        "active_from": promo.active_from,
+        "active_until": promo.active_until,
+        "mode": promo.mode,
+        "created_at": promo.created_at,
+        "active": promo.active,
+    }
+
+
+def business_promo(promo: Promo) -> dict:
+    """
+    Промокод в списке промокодов компании
+    """
+    return {
+        "id": str(promo.id),
+        "description": promo.description,
+        "image_url": promo.image_url,
+        "target": promo.target if promo.target else {},
+        "max_count": promo.max_count,
+        "active_from": format_date(promo.active_from),
+        "active_until": format_date(promo.active_until),
+        "mode": promo.mode,
+        "promo_common": promo.promo_common,
+        "promo_unique": promo.promo_unique,
+        "created_at": format_datetime(promo.created_at),
+    }
+
+
+def promo_detail(promo: Promo, like_count: int, used_count: int) -> dict:
+    """
+    Полные данные промокода для компании-владельца
+    """
+    return {
+        "promo_id": str(promo.id),
+        "description": promo.description,
+        "image_url": promo.image_url,
+        "target": promo.target or {},
+        "max_count": promo.max_count,
+        "active_from": format_date(promo.active_from),
+        "active_until": format_date(promo.active_until),
+        "mode": promo.mode,
+        "promo_common": promo.promo_common,
+        "promo_unique": promo.promo_unique or [],
+        "company_name": promo.company.name if promo.company else None,
+        "like_count": like_count,
+        "used_count": used_count,
+        "active": promo.active,
+    }
+
+
+def comment(comment: Comment, author: dict | None = None) -> dict:
+    data = {
+        "id": comment.id,
+        "content": comment.content,
+        "created_at": comment.created_at,
+        "updated_at": comment.updated_at,
+        "user_id": comment.user_id,
+    }
+    if author is not None:
+        data["author"] = author
+    return data
+
+
+def history_entry(activation: PromoActivation) -> dict:
+    return {
+        "promo_id": activation.promo_id,
+        "activation_value": activation.activation_value,
+        "activated_at": activation.activated_at,
+    }
@@ -0,0 +1,59 @@
+from typing import AsyncIterator
+
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+from src.core.serialization import dumps
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+JSON_MEDIA_TYPE = "application/json"
+
+# Размер порции, которой данные отдаются клиенту
+CHUNK_SIZE = 64 * 1024
+
+
+def stream_format(accept: str | None) -> str | None:
+    """
+    Потоковый формат ответа по заголовку Accept:
+    application/x-ndjson - объекты построчно, application/json; stream=true - JSON-массив порциями.
+    None - обычный ответ целиком
+    """
+    for part in (accept or "").split(","):
+        media_type, *params = [item.strip().lower().replace(" ", "") for item in part.split(";")]
+        if media_type == NDJSON_MEDIA_TYPE:
+            return "ndjson"
+        if media_type == JSON_MEDIA_TYPE and "stream=true" in params:
+            return "array"
+    return None
+
+
+async def _encode(items: AsyncIterator[dict], fmt: str) -> AsyncIterator[bytes]:
+    buffer = bytearray(b"[" if fmt == "array" else b"")
+    first = True
+    async for item in items:
+        if fmt == "array":
+            if not first:
+                buffer += b","
+            buffer += dumps(item)
+        else:
+            buffer += dumps(item) + b"\n"
+        first = False
+        if len(buffer) >= CHUNK_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    if fmt == "array":
+        buffer += b"]"
+    if buffer:
+        yield bytes(buffer)
+
+
+def streaming_response(items: AsyncIterator[dict], fmt: str, headers: dict) -> StreamingResponse:
+    """
+    Потоковый ответ из асинхронного итератора объектов в формате ndjson или array.
+    После ответа итератор закрывается, в том числе если клиент отключился до начала чтения:
+    так итератор освобождает сессию базы
+    """
+    media_type = NDJSON_MEDIA_TYPE if fmt == "ndjson" else JSON_MEDIA_TYPE
+    return StreamingResponse(
+        _encode(items, fmt), media_type=media_type, headers=headers, background=BackgroundTask(items.aclose),
+    )
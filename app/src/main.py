@@ -1,13 +1,18 @@
+import asyncio
 import uvicorn
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from redis.asyncio import Redis
 
 from src.db import redis
-from src.db.postgres import engine, Base
+from src.db.postgres import engine, async_session_maker
 from src.core.config import settings
 from src.api import ping, company, promo, user
+from src import migrations
+from src.services.promo import capacity_service, counter_service, like_service, activation_writer, antifraud_service, promo_index
+from src.services.user import profile_cache
 
 
 @asynccontextmanager
@@ -18,10 +23,39 @@ async def lifespan(app: FastAPI):
 
     redis.redis = Redis(host=settings.redis.host, port=settings.redis.port)
 
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    # Схема создается миграциями (python -m src.migrations upgrade) до запуска приложения,
+    # здесь только проверяется ее версия
+    await migrations.check(engine)
+
+    # Фоновая сверка счетчиков вместимости промокодов с базой
+    capacity_task = asyncio.create_task(capacity_service.run_reconciler(async_session_maker, redis.redis))
+
+    # Фоновая сверка счетчиков лайков, комментариев и активаций с исходными таблицами
+    counters_task = asyncio.create_task(counter_service.run_reconciler(async_session_maker))
+
+    # Отложенная пакетная запись активаций (если включена)
+    await activation_writer.start(async_session_maker, redis.redis)
+
+    # Пакетная запись лайков из Redis в базу (если включена)
+    await like_service.start(async_session_maker, redis.redis)
+
+    # Общий HTTP-клиент антифрод-сервиса
+    await antifraud_service.startup()
+
+    # Сброс локального кеша профилей по сообщениям других воркеров
+    profile_cache_task = asyncio.create_task(profile_cache.run_listener(redis.redis))
+
+    # Индекс активных промокодов для ленты (если включен)
+    promo_index_task = asyncio.create_task(promo_index.run(async_session_maker))
 
     yield
+    capacity_task.cancel()
+    counters_task.cancel()
+    profile_cache_task.cancel()
+    promo_index_task.cancel()
+    await activation_writer.stop()
+    await like_service.stop()
+    await antifraud_service.shutdown()
     await redis.redis.close()
     await engine.dispose()
 
@@ -32,6 +66,7 @@ app = FastAPI(
     title='Название приложения',
     description='Описание приложения',
     docs_url="/api/openapi",
+    default_response_class=ORJSONResponse,
 )
 
 app.include_router(ping.router, prefix="/api", tags=["ping"])
@@ -0,0 +1,117 @@
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+from sqlalchemy.sql.elements import conv
+
+from src.db.postgres import Base
+from src.migrations.versions import MIGRATIONS
+from src.models import company, promo, user  # noqa: F401 - регистрация таблиц в Base.metadata
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory-блокировки: одновременно миграции выполняет только один процесс
+MIGRATION_LOCK_ID = 7300119
+
+CREATE_VERSION_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    description VARCHAR NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+)
+"""
+
+
+def head_version() -> int:
+    """
+    Версия схемы, которую ожидает код приложения
+    """
+    return MIGRATIONS[-1].VERSION
+
+
+async def current_version(conn: AsyncConnection) -> int:
+    """
+    Версия схемы в базе; 0, если миграции еще не применялись
+    """
+    if (await conn.execute(text("SELECT to_regclass('schema_version')"))).scalar() is None:
+        return 0
+    return (await conn.execute(text("SELECT coalesce(max(version), 0) FROM schema_version"))).scalar()
+
+
+async def _apply(engine: AsyncEngine, migration) -> None:
+    record = text("INSERT INTO schema_version (version, description) VALUES (:version, :description)")
+    params = {"version": migration.VERSION, "description": migration.DESCRIPTION}
+
+    if migration.TRANSACTIONAL:
+        async with engine.begin() as conn:
+            await migration.upgrade(conn)
+            await conn.execute(record, params)
+        return
+
+    # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await migration.upgrade(conn)
+        await conn.execute(record, params)
+
+
+async def upgrade(engine: AsyncEngine) -> int:
+    """
+    Применение всех недостающих миграций. Возвращает итоговую версию схемы
+    """
+    async with engine.connect() as lock_conn:
+        lock_conn = await lock_conn.execution_options(isolation_level="AUTOCOMMIT")
+        await lock_conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        try:
+            await lock_conn.execute(text(CREATE_VERSION_TABLE))
+            version = await current_version(lock_conn)
+            for migration in MIGRATIONS:
+                if migration.VERSION <= version:
+                    continue
+                logger.info("Applying migration %04d: %s", migration.VERSION, migration.DESCRIPTION)
+                await _apply(engine, migration)
+                version = migration.VERSION
+
+            # Базы, созданные до миграций через create_all (в том числе промежуточными ревизиями),
+            # миграции доводят до схемы моделей; оставшееся расхождение - ошибка, а не повод запускаться
+            if missing := await missing_objects(lock_conn):
+                raise RuntimeError(f"Database schema is missing {', '.join(missing)} after migrations")
+            return version
+        finally:
+            await lock_conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+
+
+async def missing_objects(conn: AsyncConnection) -> list[str]:
+    """
+    Таблицы, колонки и именованные индексы моделей, которых нет в базе
+    """
+    columns = {
+        (table, column) for table, column in (await conn.execute(text(
+            "SELECT table_name, column_name FROM information_schema.columns WHERE table_schema = current_schema()"
+        ))).all()
+    }
+    indexes = set((await conn.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema()"
+    ))).scalars().all())
+
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        missing += [f"{table.name}.{column.name}" for column in table.columns if (table.name, column.name) not in columns]
+        # Индексы с именем по соглашению (index=True) дублируют первичный ключ и миграциями не создаются
+        missing += [index.name for index in table.indexes if not isinstance(index.name, conv) and index.name not in indexes]
+    return missing
+
+
+async def check(engine: AsyncEngine) -> None:
+    """
+    Быстрая проверка при запуске приложения: схема не старше версии, которую ожидает код.
+    Более новая схема допустима - миграции только расширяют схему, а при поэтапном
+    перезапуске старые процессы работают с уже обновленной базой
+    """
+    async with engine.connect() as conn:
+        version = await current_version(conn)
+    if version < head_version():
+        raise RuntimeError(
+            f"Database schema version {version} is older than {head_version()}, "
+            f"run `python -m src.migrations upgrade`"
+        )
@@ -0,0 +1,31 @@
+import asyncio
+import logging
+import sys
+
+from src.db.postgres import engine
+from src.migrations import upgrade, current_version, head_version, missing_objects
+
+
+async def main(command: str) -> None:
+    try:
+        if command == "upgrade":
+            version = await upgrade(engine)
+            print(f"Database schema is at version {version}")
+        elif command == "current":
+            async with engine.connect() as conn:
+                print(f"Database schema version: {await current_version(conn)}, code expects: {head_version()}")
+        elif command == "verify":
+            async with engine.connect() as conn:
+                missing = await missing_objects(conn)
+            if missing:
+                raise SystemExit(f"Database schema is missing: {', '.join(missing)}")
+            print("Database schema matches the models")
+        else:
+            raise SystemExit(f"Unknown command: {command}. Use `upgrade`, `current` or `verify`")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else "upgrade"))
@@ -0,0 +1,29 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+
+async def execute_all(conn: AsyncConnection, statements: list[str]) -> None:
+    """
+    Выполнение SQL-команд по одной (asyncpg не принимает несколько команд в одном запросе)
+    """
+    for statement in statements:
+        await conn.execute(text(statement))
+
+
+async def create_index_concurrently(conn: AsyncConnection, name: str, definition: str, unique: bool = False) -> None:
+    """
+    Построение индекса без блокировки записи в таблицу; выполняется вне транзакции.
+    Индекс, оставшийся недостроенным (INVALID) после прерванной попытки, удаляется и строится заново
+    """
+    valid = (await conn.execute(
+        text(
+            "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = :name"
+        ),
+        {"name": name},
+    )).scalar()
+    if valid:
+        return
+    if valid is not None:
+        await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    await conn.execute(text(f"CREATE {'UNIQUE ' if unique else ''}INDEX CONCURRENTLY {name} ON {definition}"))
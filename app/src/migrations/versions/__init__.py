@@ -0,0 +1,26 @@
+from src.migrations.versions import (
+    v0001_baseline,
+    v0002_promo_search_and_codes,
+    v0003_hot_path_indexes,
+    v0004_promo_counters,
+    v0005_unique_likes,
+    v0006_activation_user_index,
+    v0007_comments_page_index,
+    v0008_activation_promo_index,
+    v0009_promo_code_count,
+    v0010_feed_opening_indexes,
+)
+
+# Миграции в порядке применения; новая миграция добавляется в конец списка
+MIGRATIONS = [
+    v0001_baseline,
+    v0002_promo_search_and_codes,
+    v0003_hot_path_indexes,
+    v0004_promo_counters,
+    v0005_unique_likes,
+    v0006_activation_user_index,
+    v0007_comments_page_index,
+    v0008_activation_promo_index,
+    v0009_promo_code_count,
+    v0010_feed_opening_indexes,
+]
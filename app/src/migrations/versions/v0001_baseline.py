@@ -0,0 +1,100 @@
+"""
+Исходная схема. Таблицы создаются только при их отсутствии, поэтому миграция применима
+и к базам, созданным раньше через create_all или dump/schema.sql; расхождения такой схемы
+с моделями (JSON вместо JSONB, недостающие колонки users) исправляются
+"""
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from src.migrations.operations import execute_all
+
+VERSION = 1
+DESCRIPTION = "baseline schema"
+TRANSACTIONAL = True
+
+STATEMENTS = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """
+    CREATE TABLE IF NOT EXISTS companies (
+        id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+        email VARCHAR(255) UNIQUE NOT NULL,
+        password VARCHAR(255) NOT NULL,
+        name VARCHAR(100) NOT NULL,
+        created_at TIMESTAMP DEFAULT NOW(),
+        updated_at TIMESTAMP DEFAULT NOW()
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+        email VARCHAR(255) UNIQUE NOT NULL,
+        password VARCHAR(255) NOT NULL,
+        name VARCHAR(255),
+        surname VARCHAR(255),
+        created_at TIMESTAMP DEFAULT NOW(),
+        updated_at TIMESTAMP DEFAULT NOW(),
+        other JSONB
+    )
+    """,
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS surname VARCHAR(255)",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS other JSONB",
+    "ALTER TABLE users ALTER COLUMN name TYPE VARCHAR(255)",
+    """
+    CREATE TABLE IF NOT EXISTS promos (
+        id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+        company_id UUID NOT NULL REFERENCES companies(id) ON DELETE CASCADE,
+        mode VARCHAR(10) NOT NULL,
+        promo_common VARCHAR(50),
+        promo_unique JSONB,
+        description VARCHAR NOT NULL,
+        image_url VARCHAR,
+        target JSONB,
+        max_count INTEGER NOT NULL,
+        active_from TIMESTAMP,
+        active_until TIMESTAMP,
+        active BOOLEAN DEFAULT TRUE,
+        created_at TIMESTAMP DEFAULT NOW(),
+        updated_at TIMESTAMP DEFAULT NOW()
+    )
+    """,
+    """
+    DO $$
+    BEGIN
+        IF (SELECT data_type FROM information_schema.columns
+            WHERE table_name = 'promos' AND column_name = 'promo_unique') = 'json' THEN
+            ALTER TABLE promos ALTER COLUMN promo_unique TYPE JSONB USING promo_unique::jsonb;
+        END IF;
+    END
+    $$
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS comments (
+        id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+        promo_id UUID NOT NULL REFERENCES promos(id) ON DELETE CASCADE,
+        user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        content TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT NOW(),
+        updated_at TIMESTAMP DEFAULT NOW()
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS likes (
+        id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+        promo_id UUID NOT NULL REFERENCES promos(id) ON DELETE CASCADE,
+        user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        created_at TIMESTAMP DEFAULT NOW()
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS promo_activations (
+        id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+        promo_id UUID NOT NULL REFERENCES promos(id) ON DELETE CASCADE,
+        user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        activation_value VARCHAR(50),
+        activated_at TIMESTAMP DEFAULT NOW()
+    )
+    """,
+]
+
+
+async def upgrade(conn: AsyncConnection) -> None:
+    await execute_all(conn, STATEMENTS)
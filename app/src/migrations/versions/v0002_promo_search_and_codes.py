@@ -0,0 +1,32 @@
+"""
+Вычисляемые колонки промокодов (поисковый вектор, страна таргетинга) и пул кодов UNIQUE промокодов
+"""
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from src.migrations.operations import execute_all
+
+VERSION = 2
+DESCRIPTION = "promo search_vector, target_country and promo_codes"
+TRANSACTIONAL = True
+
+STATEMENTS = [
+    """
+    ALTER TABLE promos ADD COLUMN IF NOT EXISTS search_vector TSVECTOR GENERATED ALWAYS AS (
+        to_tsvector('simple', coalesce(description, '') || ' ' || coalesce(promo_common, ''))
+    ) STORED
+    """,
+    "ALTER TABLE promos ADD COLUMN IF NOT EXISTS target_country VARCHAR GENERATED ALWAYS AS (lower(target ->> 'country')) STORED",
+    """
+    CREATE TABLE IF NOT EXISTS promo_codes (
+        id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+        promo_id UUID NOT NULL REFERENCES promos(id) ON DELETE CASCADE,
+        value VARCHAR(50) NOT NULL,
+        claimed_by UUID REFERENCES users(id) ON DELETE CASCADE,
+        claimed_at TIMESTAMP
+    )
+    """,
+]
+
+
+async def upgrade(conn: AsyncConnection) -> None:
+    await execute_all(conn, STATEMENTS)
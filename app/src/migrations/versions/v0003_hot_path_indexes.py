@@ -0,0 +1,32 @@
+"""
+Индексы горячих запросов: лента, поиск, список компании, активации и пул кодов.
+Строятся через CREATE INDEX CONCURRENTLY, чтобы не блокировать запись в рабочие таблицы
+"""
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from src.migrations.operations import create_index_concurrently
+
+VERSION = 3
+DESCRIPTION = "hot path indexes"
+TRANSACTIONAL = False
+
+INDEXES = {
+    "ix_promos_created_at_id": "promos (created_at, id)",
+    "ix_promos_updated_at": "promos (updated_at)",
+    "ix_promos_search_vector": "promos USING gin (search_vector)",
+    "ix_promos_description_trgm": "promos USING gin (description gin_trgm_ops)",
+    "ix_promos_promo_common_trgm": "promos USING gin (promo_common gin_trgm_ops)",
+    "ix_promos_company_id_created_at_id": "promos (company_id, created_at, id)",
+    "ix_promos_company_id_active_from_id": "promos (company_id, active_from, id)",
+    "ix_promos_company_id_active_until_id": "promos (company_id, active_until, id)",
+    "ix_promos_company_id_target_country": "promos (company_id, target_country)",
+    "ix_promos_target_country_created_at_id": "promos (target_country, created_at, id)",
+    "ix_promos_target": "promos USING gin (target jsonb_path_ops)",
+    "ix_promo_activations_activated_at": "promo_activations (activated_at)",
+    "ix_promo_codes_promo_id_free": "promo_codes (promo_id) WHERE claimed_by IS NULL",
+}
+
+
+async def upgrade(conn: AsyncConnection) -> None:
+    for name, definition in INDEXES.items():
+        await create_index_concurrently(conn, name, definition)
@@ -0,0 +1,38 @@
+"""
+Денормализованные счетчики лайков, комментариев и активаций промокодов с начальным заполнением
+"""
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from src.migrations.operations import execute_all
+
+VERSION = 4
+DESCRIPTION = "promo counters"
+TRANSACTIONAL = True
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS promo_counters (
+        promo_id UUID PRIMARY KEY REFERENCES promos(id) ON DELETE CASCADE,
+        like_count INTEGER NOT NULL DEFAULT 0,
+        comment_count INTEGER NOT NULL DEFAULT 0,
+        activation_count INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    INSERT INTO promo_counters (promo_id, like_count, comment_count, activation_count)
+    SELECT
+        promos.id,
+        (SELECT count(*) FROM likes WHERE likes.promo_id = promos.id),
+        (SELECT count(*) FROM comments WHERE comments.promo_id = promos.id),
+        (SELECT count(*) FROM promo_activations WHERE promo_activations.promo_id = promos.id)
+    FROM promos
+    ON CONFLICT (promo_id) DO UPDATE SET
+        like_count = excluded.like_count,
+        comment_count = excluded.comment_count,
+        activation_count = excluded.activation_count
+    """,
+]
+
+
+async def upgrade(conn: AsyncConnection) -> None:
+    await execute_all(conn, STATEMENTS)
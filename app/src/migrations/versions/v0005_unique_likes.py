@@ -0,0 +1,30 @@
+"""
+Уникальность лайка пользователя на промокод. Существующие дубликаты удаляются,
+счетчики лайков пересчитываются, индекс строится без блокировки записи
+"""
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from src.migrations.operations import execute_all, create_index_concurrently
+
+VERSION = 5
+DESCRIPTION = "unique likes per user"
+TRANSACTIONAL = False
+
+STATEMENTS = [
+    """
+    DELETE FROM likes
+    USING likes AS kept
+    WHERE likes.promo_id = kept.promo_id
+      AND likes.user_id = kept.user_id
+      AND likes.id > kept.id
+    """,
+    """
+    UPDATE promo_counters
+    SET like_count = (SELECT count(*) FROM likes WHERE likes.promo_id = promo_counters.promo_id)
+    """,
+]
+
+
+async def upgrade(conn: AsyncConnection) -> None:
+    await execute_all(conn, STATEMENTS)
+    await create_index_concurrently(conn, "ux_likes_promo_id_user_id", "likes (promo_id, user_id)", unique=True)
@@ -0,0 +1,16 @@
+"""
+Индекс активаций по пользователю для признака is_activated_by_user в карточках ленты
+"""
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from src.migrations.operations import create_index_concurrently
+
+VERSION = 6
+DESCRIPTION = "promo activations by user index"
+TRANSACTIONAL = False
+
+
+async def upgrade(conn: AsyncConnection) -> None:
+    await create_index_concurrently(
+        conn, "ix_promo_activations_user_id_promo_id", "promo_activations (user_id, promo_id)",
+    )
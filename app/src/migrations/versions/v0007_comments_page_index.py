@@ -0,0 +1,16 @@
+"""
+Индекс постраничного вывода комментариев промокода от новых к старым
+"""
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from src.migrations.operations import create_index_concurrently
+
+VERSION = 7
+DESCRIPTION = "comments page index"
+TRANSACTIONAL = False
+
+
+async def upgrade(conn: AsyncConnection) -> None:
+    await create_index_concurrently(
+        conn, "ix_comments_promo_id_created_at_id", "comments (promo_id, created_at DESC, id DESC)",
+    )
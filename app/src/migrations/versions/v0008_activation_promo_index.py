@@ -0,0 +1,14 @@
+"""
+Индекс активаций по промокоду для подсчета активаций промокода
+"""
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from src.migrations.operations import create_index_concurrently
+
+VERSION = 8
+DESCRIPTION = "promo activations by promo index"
+TRANSACTIONAL = False
+
+
+async def upgrade(conn: AsyncConnection) -> None:
+    await create_index_concurrently(conn, "ix_promo_activations_promo_id", "promo_activations (promo_id)")
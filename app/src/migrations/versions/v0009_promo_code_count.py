@@ -0,0 +1,22 @@
+"""
+Количество кодов UNIQUE промокода в вычисляемой колонке: фильтр ленты и индекс активных промокодов
+не читают массив promo_unique
+"""
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from src.migrations.operations import execute_all
+
+VERSION = 9
+DESCRIPTION = "promo code count"
+TRANSACTIONAL = True
+
+STATEMENTS = [
+    """
+    ALTER TABLE promos ADD COLUMN IF NOT EXISTS code_count INTEGER
+        GENERATED ALWAYS AS (coalesce(jsonb_array_length(promo_unique), 0)) STORED
+    """,
+]
+
+
+async def upgrade(conn: AsyncConnection) -> None:
+    await execute_all(conn, STATEMENTS)
@@ -0,0 +1,21 @@
+"""
+Частичные индексы по active_from активных промокодов: срок жизни страницы ленты в кеше
+ограничивается ближайшим открытием промокода во всей ленте или в сегменте страны
+"""
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from src.migrations.operations import create_index_concurrently
+
+VERSION = 10
+DESCRIPTION = "feed opening indexes"
+TRANSACTIONAL = False
+
+INDEXES = {
+    "ix_promos_active_from_active": "promos (active_from) WHERE active",
+    "ix_promos_target_country_active_from_active": "promos (target_country, active_from) WHERE active",
+}
+
+
+async def upgrade(conn: AsyncConnection) -> None:
+    for name, definition in INDEXES.items():
+        await create_index_concurrently(conn, name, definition)
@@ -1,10 +1,10 @@
 from datetime import datetime
 import uuid
 
-from sqlalchemy import Column, String, Integer, Boolean, ForeignKey, JSON, DateTime, Text
+from sqlalchemy import Column, String, Integer, Boolean, ForeignKey, JSON, DateTime, Text, Index, Computed
 from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.orm import relationship
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import relationship, deferred
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from sqlalchemy.sql import func, text
 
 
@@ -18,7 +18,9 @@ class Promo(Base):
     company_id = Column(UUID(as_uuid=True), ForeignKey("companies.id", ondelete="CASCADE"), nullable=False)
     mode = Column(String(10), nullable=False)
     promo_common = Column(String(50), nullable=True)
-    promo_unique = Column(JSONB, nullable=True)
+    # Исходный список кодов UNIQUE промокода. Не загружается по умолчанию: выдача идет из пула кодов,
+    # а количество кодов хранится в code_count
+    promo_unique = deferred(Column(JSONB, nullable=True))
     description = Column(String, nullable=False)
     image_url = Column(String, nullable=True)
     target = Column(JSONB, nullable=True)
@@ -28,12 +30,47 @@ class Promo(Base):
     active = Column(Boolean, default=True)
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+    # Поисковый вектор по описанию и коду промокода, вычисляется базой
+    search_vector = deferred(Column(
+        TSVECTOR,
+        Computed("to_tsvector('simple', coalesce(description, '') || ' ' || coalesce(promo_common, ''))", persisted=True),
+    ))
+    # Страна таргетинга в нижнем регистре, вычисляется базой; NULL - без ограничения по стране
+    target_country = Column(String, Computed("lower(target ->> 'country')", persisted=True))
+    # Количество кодов UNIQUE промокода, вычисляется базой: лента и индекс не разбирают promo_unique
+    code_count = Column(Integer, Computed("coalesce(jsonb_array_length(promo_unique), 0)", persisted=True))
 
     # Связи с другими таблицами
     company = relationship("Company", back_populates="promos")
     comments = relationship("Comment", back_populates="promo")
     likes = relationship("Like", back_populates="promo")
 
+    __table_args__ = (
+        # Стабильный порядок ленты и keyset-пагинация по (created_at, id)
+        Index("ix_promos_created_at_id", "created_at", "id"),
+        # Дельта-опрос изменений для индекса активных промокодов
+        Index("ix_promos_updated_at", "updated_at"),
+        # Полнотекстовый поиск по словам и триграммный поиск по подстроке (расширение pg_trgm)
+        Index("ix_promos_search_vector", "search_vector", postgresql_using="gin"),
+        Index("ix_promos_description_trgm", "description", postgresql_using="gin", postgresql_ops={"description": "gin_trgm_ops"}),
+        Index("ix_promos_promo_common_trgm", "promo_common", postgresql_using="gin", postgresql_ops={"promo_common": "gin_trgm_ops"}),
+        # Keyset-пагинация списка компании по каждому полю сортировки
+        Index("ix_promos_company_id_created_at_id", "company_id", "created_at", "id"),
+        Index("ix_promos_company_id_active_from_id", "company_id", "active_from", "id"),
+        Index("ix_promos_company_id_active_until_id", "company_id", "active_until", "id"),
+        # Фильтрация по стране: список компании и лента
+        Index("ix_promos_company_id_target_country", "company_id", "target_country"),
+        Index("ix_promos_target_country_created_at_id", "target_country", "created_at", "id"),
+        # Поиск по содержимому таргетинга оператором @>
+        Index("ix_promos_target", "target", postgresql_using="gin", postgresql_ops={"target": "jsonb_path_ops"}),
+        # Ближайшее открытие активного промокода для срока жизни страниц ленты: вся лента и сегмент страны
+        Index("ix_promos_active_from_active", "active_from", postgresql_where=text("active")),
+        Index("ix_promos_target_country_active_from_active", "target_country", "active_from", postgresql_where=text("active")),
+    )
+
+    # Значения, вычисляемые базой (updated_at), возвращаются сразу через RETURNING
+    __mapper_args__ = {"eager_defaults": True}
+
 
 class Comment(Base):
     __tablename__ = "comments"
@@ -48,6 +85,11 @@ class Comment(Base):
     promo = relationship("Promo", back_populates="comments")
     user = relationship("User", back_populates="comments")
 
+    __table_args__ = (
+        # Постраничный вывод комментариев промокода от новых к старым
+        Index("ix_comments_promo_id_created_at_id", "promo_id", text("created_at DESC"), text("id DESC")),
+    )
+
 
 class Like(Base):
     __tablename__ = "likes"
@@ -60,6 +102,11 @@ class Like(Base):
     promo = relationship("Promo", back_populates="likes")
     user = relationship("User", back_populates="likes")
 
+    __table_args__ = (
+        # Один лайк пользователя на промокод; пакетная запись опирается на ON CONFLICT по этому индексу
+        Index("ux_likes_promo_id_user_id", "promo_id", "user_id", unique=True),
+    )
+
 
 class PromoActivation(Base):
     __tablename__ = "promo_activations"
@@ -72,3 +119,38 @@ class PromoActivation(Base):
 
     promo = relationship("Promo")
     user = relationship("User")
+
+    __table_args__ = (
+        # Дельта-опрос новых активаций для индекса активных промокодов
+        Index("ix_promo_activations_activated_at", "activated_at"),
+        # Подсчет активаций промокода (вместимость, сверка счетчиков, статистика)
+        Index("ix_promo_activations_promo_id", "promo_id"),
+        # Проверка активации промокода пользователем в карточках ленты
+        Index("ix_promo_activations_user_id_promo_id", "user_id", "promo_id"),
+    )
+
+
+class PromoCode(Base):
+    __tablename__ = "promo_codes"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, server_default=text("gen_random_uuid()"))
+    promo_id = Column(UUID(as_uuid=True), ForeignKey("promos.id", ondelete="CASCADE"), nullable=False)
+    value = Column(String(50), nullable=False)
+    claimed_by = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=True)
+    claimed_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # Частичный индекс по свободным кодам для выдачи через FOR UPDATE SKIP LOCKED
+        Index("ix_promo_codes_promo_id_free", "promo_id", postgresql_where=text("claimed_by IS NULL")),
+    )
+
+
+class PromoCounter(Base):
+    __tablename__ = "promo_counters"
+
+    # Счетчики обновляются в тех же транзакциях, что и лайки, комментарии и активации,
+    # и периодически сверяются с исходными таблицами
+    promo_id = Column(UUID(as_uuid=True), ForeignKey("promos.id", ondelete="CASCADE"), primary_key=True)
+    like_count = Column(Integer, nullable=False, server_default=text("0"))
+    comment_count = Column(Integer, nullable=False, server_default=text("0"))
+    activation_count = Column(Integer, nullable=False, server_default=text("0"))
@@ -0,0 +1,259 @@
+import asyncio
+import json
+import logging
+import time
+from collections import Counter
+from datetime import datetime
+from uuid import uuid4
+
+from redis.asyncio import Redis
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.future import select
+
+from src.core.config import settings
+from src.models.promo import PromoActivation
+from src.services.counters import CounterService
+from src.services.etag import EtagService
+
+logger = logging.getLogger(__name__)
+
+# Количество принятых, но еще не записанных в базу активаций по промокодам (общее для всех воркеров)
+PENDING_KEY = "promo:activations:pending"
+# Очередь принятых активаций, ожидающих записи в базу (общая для всех воркеров)
+BACKLOG_KEY = "promo:activations:backlog"
+# Активации, взятые воркером на запись, со временем взятия; после падения воркера возвращаются в очередь
+INFLIGHT_KEY = "promo:activations:inflight"
+
+# Постановка активации в очередь вместе с увеличением счетчика незаписанных активаций промокода
+SUBMIT_SCRIPT = """
+redis.call('RPUSH', KEYS[1], ARGV[1])
+redis.call('HINCRBY', KEYS[2], ARGV[2], 1)
+"""
+
+# Взятие пакета из очереди на запись: активации остаются в Redis до подтверждения записи
+CLAIM_SCRIPT = """
+local items = redis.call('LPOP', KEYS[1], ARGV[1])
+if not items then
+    return {}
+end
+for _, item in ipairs(items) do
+    redis.call('ZADD', KEYS[2], ARGV[2], item)
+end
+return items
+"""
+
+# Подтверждение записи. Счетчик уменьшается только за активации, которые еще числились взятыми:
+# активация, возвращенная в очередь по таймауту и записанная другим воркером, не уменьшит его дважды
+ACK_SCRIPT = """
+for i = 1, #ARGV do
+    if redis.call('ZREM', KEYS[1], ARGV[i]) == 1 then
+        local promo_id = cjson.decode(ARGV[i])['promo_id']
+        if redis.call('HINCRBY', KEYS[2], promo_id, -1) <= 0 then
+            redis.call('HDEL', KEYS[2], promo_id)
+        end
+    end
+end
+"""
+
+# Возврат в очередь переданных активаций (ошибка записи) или взятых раньше ARGV[1] (воркер упал)
+REQUEUE_SCRIPT = """
+local items = {}
+if #ARGV > 1 then
+    items = {unpack(ARGV, 2)}
+else
+    items = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+end
+local requeued = 0
+for _, item in ipairs(items) do
+    if redis.call('ZREM', KEYS[1], item) == 1 then
+        redis.call('RPUSH', KEYS[2], item)
+        requeued = requeued + 1
+    end
+end
+return requeued
+"""
+
+# Пересчет счетчиков незаписанных активаций по очереди. Активации, уже записанные в базу (ARGV),
+# удаляются из очереди без повторной записи. Возвращает промокоды, счетчик которых уменьшился
+REBUILD_SCRIPT = """
+for i = 1, #ARGV do
+    redis.call('LREM', KEYS[1], 0, ARGV[i])
+    redis.call('ZREM', KEYS[2], ARGV[i])
+end
+local counts = {}
+local function tally(items)
+    for _, item in ipairs(items) do
+        local promo_id = cjson.decode(item)['promo_id']
+        counts[promo_id] = (counts[promo_id] or 0) + 1
+    end
+end
+tally(redis.call('LRANGE', KEYS[1], 0, -1))
+tally(redis.call('ZRANGE', KEYS[2], 0, -1))
+local lowered = {}
+local current = redis.call('HGETALL', KEYS[3])
+for i = 1, #current, 2 do
+    if tonumber(current[i + 1]) > (counts[current[i]] or 0) then
+        table.insert(lowered, current[i])
+    end
+end
+redis.call('DEL', KEYS[3])
+for promo_id, count in pairs(counts) do
+    redis.call('HSET', KEYS[3], promo_id, count)
+end
+return lowered
+"""
+
+
+async def rebuild_pending(db: AsyncSession, redis: Redis) -> list[str]:
+    """
+    Приведение PENDING_KEY к содержимому очереди: счетчики, оставшиеся от потерянных активаций,
+    занижали бы вместимость промокодов навсегда. Возвращает промокоды, счетчик которых уменьшился
+    """
+    queued = await redis.lrange(BACKLOG_KEY, 0, -1) + await redis.zrange(INFLIGHT_KEY, 0, -1)
+    by_id = {json.loads(raw)["id"]: raw for raw in queued}
+    written = (await db.execute(
+        select(PromoActivation.id).where(PromoActivation.id.in_(by_id))
+    )).scalars().all() if by_id else []
+    lowered = await redis.eval(
+        REBUILD_SCRIPT, 3, BACKLOG_KEY, INFLIGHT_KEY, PENDING_KEY, *[by_id[str(id_)] for id_ in written]
+    )
+    return [promo_id.decode() for promo_id in lowered]
+
+
+class ActivationWriter:
+    """
+    Отложенная пакетная запись активаций промокодов (write-behind).
+    Принятые активации попадают в очередь в Redis, фоновая задача забирает их пакетами до batch_size
+    и пишет в базу многострочными INSERT. Активация удаляется из Redis только после записи,
+    поэтому падение воркера не теряет принятые активации
+    """
+
+    def __init__(self):
+        self.enabled = settings.activation_writer.enabled
+        self.batch_size = settings.activation_writer.batch_size
+        self.flush_interval = settings.activation_writer.flush_interval
+        self.claim_timeout = settings.activation_writer.claim_timeout
+        self.session_maker: async_sessionmaker | None = None
+        self.redis: Redis | None = None
+        self._task: asyncio.Task | None = None
+        self._stopping = asyncio.Event()
+        self.counters = CounterService()
+        self.etags = EtagService()
+
+    async def start(self, session_maker: async_sessionmaker, redis: Redis) -> None:
+        """
+        Запуск фоновой записи; активации, оставшиеся с прошлого запуска, дозаписываются фоновой задачей
+        """
+        if not self.enabled:
+            return
+        self.session_maker = session_maker
+        self.redis = redis
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Остановка с записью накопленных активаций; не записанные остаются в очереди до следующего запуска
+        """
+        if self._task is None:
+            return
+        self._stopping.set()
+        await self._task
+        self._task = None
+        try:
+            while await self._flush_next() == self.batch_size:
+                pass
+        except Exception:
+            logger.exception("Failed to flush promo activations on shutdown, they remain in backlog")
+
+    async def submit(self, promo_id, user_id: str, activation_value: str | None) -> dict:
+        """
+        Постановка активации в очередь на запись
+        """
+        # Идентификатор задается заранее, чтобы повторная запись после сбоя не создавала дубликатов
+        activation = {
+            "id": str(uuid4()),
+            "promo_id": str(promo_id),
+            "user_id": str(user_id),
+            "activation_value": activation_value,
+            "activated_at": datetime.utcnow(),
+        }
+        await self.redis.eval(SUBMIT_SCRIPT, 2, BACKLOG_KEY, PENDING_KEY, self._dump(activation), activation["promo_id"])
+        return activation
+
+    async def _run(self) -> None:
+        next_requeue = 0.0
+        while not self._stopping.is_set():
+            written = 0
+            try:
+                # Активации, зависшие у упавшего воркера, возвращаются в очередь
+                if asyncio.get_running_loop().time() >= next_requeue:
+                    await self._requeue(time.time() - self.claim_timeout)
+                    next_requeue = asyncio.get_running_loop().time() + self.claim_timeout / 2
+                written = await self._flush_next()
+            except Exception:
+                logger.exception("Failed to flush promo activations")
+
+            # Полные пакеты пишутся подряд, иначе очередь проверяется раз в flush_interval
+            if written < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _write(self, batch: list[dict]) -> set:
+        async with self.session_maker() as db:
+            # Счетчики увеличиваются только на фактически вставленные строки (повторная запись их не дублирует)
+            inserted = (await db.execute(
+                insert(PromoActivation).values(batch).on_conflict_do_nothing().returning(PromoActivation.promo_id)
+            )).scalars().all()
+            await self.counters.increment_many(db, [
+                {"promo_id": promo_id, "activation_count": count}
+                for promo_id, count in Counter(inserted).items()
+            ])
+            await db.commit()
+        return set(inserted)
+
+    async def _flush_next(self) -> int:
+        """
+        Запись следующего пакета из очереди. Возвращает количество записанных активаций;
+        при ошибке пакет возвращается в очередь для повторной записи
+        """
+        batch = await self.redis.eval(CLAIM_SCRIPT, 2, BACKLOG_KEY, INFLIGHT_KEY, self.batch_size, time.time())
+        if not batch:
+            return 0
+
+        try:
+            promo_ids = await self._write([self._load(raw) for raw in batch])
+        except Exception:
+            logger.exception("Failed to write %d promo activations, returning them to backlog", len(batch))
+            # Если недоступен и Redis, пакет вернется в очередь по истечении claim_timeout
+            await self._requeue(0, batch)
+            return 0
+
+        # Активации уже в базе: ошибка Redis здесь оставляет их взятыми, и повторная запись их не продублирует
+        try:
+            await self.redis.eval(ACK_SCRIPT, 2, INFLIGHT_KEY, PENDING_KEY, *batch)
+            await self.etags.invalidate(self.redis, promo_ids)
+        except Exception:
+            logger.exception("Failed to acknowledge %d written promo activations", len(batch))
+        return len(batch)
+
+    async def _requeue(self, claimed_before: float, batch: list[bytes] = ()) -> None:
+        """
+        Возврат в очередь пакета batch или, если он не передан, активаций, взятых раньше claimed_before
+        """
+        requeued = await self.redis.eval(REQUEUE_SCRIPT, 2, INFLIGHT_KEY, BACKLOG_KEY, claimed_before, *batch)
+        if requeued and not batch:
+            logger.warning("Returned %d stale promo activations to backlog", requeued)
+
+    @staticmethod
+    def _dump(activation: dict) -> str:
+        return json.dumps({**activation, "activated_at": activation["activated_at"].isoformat()})
+
+    @staticmethod
+    def _load(raw: bytes) -> dict:
+        activation = json.loads(raw)
+        activation["activated_at"] = datetime.fromisoformat(activation["activated_at"])
+        return activation
@@ -1,59 +1,233 @@
+import asyncio
 import json
-from datetime import datetime
+import logging
+import time
+from datetime import datetime, timezone
 from redis.asyncio import Redis
 from fastapi import HTTPException
 import httpx
 
+from src.core.cache import TTLCache, SingleFlight
+from src.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    Автоматический выключатель: после серии ошибок запросы к сервису не выполняются
+    в течение reset_timeout, затем пропускается один пробный запрос
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._trial_in_progress = False
+
+    def allow(self) -> bool:
+        """
+        Можно ли выполнить запрос к сервису
+        """
+        if self.opened_at is None:
+            return True
+        if not self._trial_in_progress and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._trial_in_progress = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_progress = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_in_progress = False
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def release(self) -> None:
+        """
+        Завершение пробного запроса, результат которого не записан (отмена или непредвиденная ошибка):
+        иначе выключатель навсегда остался бы в ожидании пробного запроса
+        """
+        self._trial_in_progress = False
+
 
 class AntifraudService:
     def __init__(self, antifraud_address: str):
         self.antifraud_address = antifraud_address
+        self.fail_open = settings.antifraud.fail_open
+        self.client: httpx.AsyncClient | None = None
+        self.breaker = CircuitBreaker(
+            failure_threshold=settings.antifraud.breaker_failure_threshold,
+            reset_timeout=settings.antifraud.breaker_reset_timeout,
+        )
+        # Первый уровень кеша вердиктов в памяти процесса, второй - Redis
+        self.local_cache = TTLCache(
+            maxsize=settings.antifraud.local_cache_size,
+            ttl=settings.antifraud.local_cache_ttl,
+        )
+        self.single_flight = SingleFlight()
+        self.prefetch_enabled = settings.antifraud.prefetch
+        self.prefetch_concurrency = settings.antifraud.prefetch_concurrency
+        self._prefetch_tasks: dict[tuple[str, str], asyncio.Task] = {}
+
+    def _create_client(self) -> httpx.AsyncClient:
+        """
+        Общий HTTP-клиент с пулом keep-alive соединений и таймаутами
+        """
+        return httpx.AsyncClient(
+            base_url=self.antifraud_address,
+            limits=httpx.Limits(
+                max_connections=settings.antifraud.max_connections,
+                max_keepalive_connections=settings.antifraud.max_keepalive_connections,
+                keepalive_expiry=settings.antifraud.keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(
+                settings.antifraud.read_timeout,
+                connect=settings.antifraud.connect_timeout,
+            ),
+        )
+
+    async def startup(self) -> None:
+        """
+        Создание HTTP-клиента при запуске приложения
+        """
+        if self.client is None:
+            self.client = self._create_client()
+
+    async def shutdown(self) -> None:
+        """
+        Закрытие HTTP-клиента при остановке приложения
+        """
+        for task in list(self._prefetch_tasks.values()):
+            task.cancel()
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def _fallback(self) -> bool:
+        """
+        Вердикт при недоступности антифрод-сервиса согласно политике ANTIFRAUD_FAIL_OPEN
+        """
+        return self.fail_open
+
+    @staticmethod
+    def _parse_datetime(value: str) -> datetime:
+        """
+        Разбор даты из ответа антифрод-сервиса в наивное UTC-время
+        """
+        parsed = datetime.fromisoformat(value)
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        return parsed
 
     async def check_user(self, user_email: str, promo_id: str, redis: Redis) -> bool:
         """
-        Проверка пользователя через антифрод-сервис с кешированием в Redis
+        Проверка пользователя через антифрод-сервис с кешированием в памяти и в Redis.
+        Параллельные запросы по одной паре (пользователь, промокод) выполняют один общий запрос
+        """
+        key = (user_email, str(promo_id))
+        verdict = self.local_cache.get(key)
+        if verdict is not None:
+            return verdict
+        return await self.single_flight.do(key, lambda: self._check_remote(user_email, str(promo_id), redis))
+
+    def prefetch(self, user_email: str, promo_id: str, redis: Redis) -> None:
+        """
+        Фоновый запрос вердикта заранее, до активации промокода.
+        Повторные запросы по той же паре и запросы сверх лимита одновременных проверок пропускаются
+        """
+        if not self.prefetch_enabled:
+            return
+
+        key = (user_email, str(promo_id))
+        if key in self._prefetch_tasks or self.single_flight.in_flight(key):
+            return
+        if len(self._prefetch_tasks) >= self.prefetch_concurrency or self.local_cache.get(key) is not None:
+            return
+
+        task = asyncio.create_task(self._prefetch(user_email, str(promo_id), redis))
+        self._prefetch_tasks[key] = task
+        task.add_done_callback(lambda _: self._prefetch_tasks.pop(key, None))
+
+    async def _prefetch(self, user_email: str, promo_id: str, redis: Redis) -> None:
+        try:
+            await self.check_user(user_email, promo_id, redis)
+        except Exception:
+            logger.debug("Antifraud prefetch failed", exc_info=True)
+
+    async def _check_remote(self, user_email: str, promo_id: str, redis: Redis) -> bool:
+        """
+        Получение вердикта из Redis или от антифрод-сервиса
         """
         cache_key = f"antifraud:{user_email}:{promo_id}"
+        local_key = (user_email, promo_id)
 
         # Проверяем кеш
         cached_result = await redis.get(cache_key)
         if cached_result:
             cached_data = json.loads(cached_result)
-            cache_until = datetime.strptime(cached_data["cache_until"], "%Y-%m-%dT%H:%M:%S.%f")
-            if datetime.utcnow() < cache_until:
+            cache_until = self._parse_datetime(cached_data["cache_until"])
+            ttl = (cache_until - datetime.utcnow()).total_seconds()
+            if ttl > 0:
+                self.local_cache.set(local_key, cached_data["ok"], ttl)
                 return cached_data["ok"]
 
+        # Пока выключатель разомкнут, сервис не опрашивается
+        if not self.breaker.allow():
+            return self._fallback()
+        # Запрос при разомкнутом выключателе - пробный
+        trial = self.breaker.opened_at is not None
+
         # Формируем запрос
-        url = f"{self.antifraud_address}/api/validate"
         headers = {"Content-Type": "application/json"}
         payload = {
             "user_email": user_email,
             "promo_id": promo_id,
         }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=payload, headers=headers)
-            if response.status_code != 200:
-                raise HTTPException(status_code=response.status_code, detail="Antifraud service error.")
+        try:
+            if self.client is None:
+                await self.startup()
+
+            try:
+                response = await self.client.post("/api/validate", json=payload, headers=headers)
+            except httpx.HTTPError:
+                logger.warning("Antifraud service request failed", exc_info=True)
+                self.breaker.record_failure()
+                return self._fallback()
 
-            data = response.json()
+            if response.status_code >= 500:
+                self.breaker.record_failure()
+                return self._fallback()
+            self.breaker.record_success()
+        finally:
+            if trial:
+                self.breaker.release()
 
-            # Проверяем обязательные поля ответа
-            if "ok" not in data:
-                raise HTTPException(status_code=500, detail="Invalid response from antifraud service.")
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code, detail="Antifraud service error.")
 
-            # Обновляем кеш
-            cache_until = datetime.utcnow()
-            if "cache_until" in data:
-                cache_until = datetime.strptime(data["cache_until"], "%Y-%m-%dT%H:%M:%S.%f")
+        data = response.json()
 
-            cached_data = {
-                "ok": data["ok"],
-                "cache_until": cache_until.strftime("%Y-%m-%dT%H:%M:%S.%f"),
-            }
+        # Проверяем обязательные поля ответа
+        if "ok" not in data:
+            raise HTTPException(status_code=500, detail="Invalid response from antifraud service.")
 
-            # Сохраняем данные в Redis с TTL
-            ttl = (cache_until - datetime.utcnow()).seconds
-            await redis.set(cache_key, json.dumps(cached_data), ex=ttl)
+        # Вердикт кешируется только до cache_until; если срок уже прошел, кеш не обновляется
+        if "cache_until" in data:
+            cache_until = self._parse_datetime(data["cache_until"])
+            ttl = (cache_until - datetime.utcnow()).total_seconds()
+            if ttl > 0:
+                cached_data = {
+                    "ok": data["ok"],
+                    "cache_until": cache_until.strftime("%Y-%m-%dT%H:%M:%S.%f"),
+                }
+                await redis.set(cache_key, json.dumps(cached_data), px=max(int(ttl * 1000), 1))
+                self.local_cache.set(local_key, data["ok"], ttl)
 
-            return data["ok"]
\ No newline at end of file
+        return data["ok"]
@@ -0,0 +1,151 @@
+import asyncio
+import logging
+
+from redis.asyncio import Redis
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.future import select
+from sqlalchemy.sql import func
+
+from src.core.config import settings
+from src.models.promo import Promo, PromoActivation
+from src.services.activation_writer import PENDING_KEY, rebuild_pending
+
+logger = logging.getLogger(__name__)
+
+# Атомарное резервирование места: -1 - счетчик не инициализирован, 0 - мест нет,
+# иначе место зарезервировано и возвращается остаток после резервирования плюс один.
+# Если передано начальное значение (ARGV[1]), отсутствующий счетчик сначала инициализируется им.
+RESERVE_SCRIPT = """
+local remaining = redis.call('GET', KEYS[1])
+if not remaining then
+    if ARGV[1] == '' then
+        return -1
+    end
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+    remaining = ARGV[1]
+end
+if tonumber(remaining) <= 0 then
+    return 0
+end
+return redis.call('DECR', KEYS[1]) + 1
+"""
+
+# Сверка может только уменьшить остаток: незавершенные резервирования и активации, записанные
+# между чтениями базы и очереди, дают завышенный расчет, и поднимать по нему счетчик нельзя
+LOWER_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if current and tonumber(current) > tonumber(ARGV[1]) then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+    return 1
+end
+return 0
+"""
+
+# Возврат места выполняется только для существующего счетчика, иначе он будет заново посчитан по базе
+RELEASE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('INCR', KEYS[1])
+end
+return -1
+"""
+
+
+class CapacityService:
+    """
+    Счетчики оставшейся вместимости COMMON промокодов в Redis.
+    Счетчик инициализируется из Postgres при первом обращении и периодически сверяется с базой
+    """
+
+    def __init__(self):
+        self.key_ttl = settings.capacity.key_ttl
+        self.reconcile_interval = settings.capacity.reconcile_interval
+
+    @staticmethod
+    def _key(promo_id) -> str:
+        return f"promo:capacity:{promo_id}"
+
+    async def _remaining_from_db(self, promo: Promo, db: AsyncSession, redis: Redis) -> int:
+        """
+        Подсчет оставшейся вместимости промокода по данным базы с учетом еще не записанных активаций.
+        Очередь читается раньше базы: пакет, записанный между чтениями, будет учтен дважды,
+        и остаток окажется заниженным, а не завышенным
+        """
+        pending = int(await redis.hget(PENDING_KEY, str(promo.id)) or 0)
+        used = (await db.execute(
+            select(func.count()).where(PromoActivation.promo_id == promo.id)
+        )).scalar()
+        return max(promo.max_count - used - pending, 0)
+
+    async def reserve(self, promo: Promo, db: AsyncSession, redis: Redis) -> int | None:
+        """
+        Атомарно резервирует одно место для активации промокода.
+        Возвращает количество оставшихся мест или None, если мест нет
+        """
+        key = self._key(promo.id)
+        result = await redis.eval(RESERVE_SCRIPT, 1, key, "", self.key_ttl)
+        if result == -1:
+            remaining = await self._remaining_from_db(promo, db, redis)
+            result = await redis.eval(RESERVE_SCRIPT, 1, key, remaining, self.key_ttl)
+        if result <= 0:
+            return None
+        return result - 1
+
+    async def release(self, promo_id, redis: Redis) -> None:
+        """
+        Возвращает зарезервированное место (например, при откате транзакции)
+        """
+        await redis.eval(RELEASE_SCRIPT, 1, self._key(promo_id))
+
+    async def invalidate(self, promo_id, redis: Redis) -> None:
+        """
+        Сбрасывает счетчик, чтобы он был заново посчитан по базе (например, после изменения max_count)
+        """
+        await redis.delete(self._key(promo_id))
+
+    async def reconcile(self, db: AsyncSession, redis: Redis) -> None:
+        """
+        Сверка существующих счетчиков с количеством активаций в базе и в очереди на запись.
+        Счетчик только уменьшается до рассчитанного значения (например, после активаций, прошедших мимо Redis);
+        увеличивается он только возвратом резервирования и сбросом после изменения max_count
+        """
+        pending = {key.decode(): int(value) for key, value in (await redis.hgetall(PENDING_KEY)).items()}
+        query = (
+            select(Promo.id, Promo.max_count, func.count(PromoActivation.id))
+            .outerjoin(PromoActivation, PromoActivation.promo_id == Promo.id)
+            .where(Promo.mode == "COMMON", Promo.active == True)
+            .group_by(Promo.id, Promo.max_count)
+        )
+        rows = (await db.execute(query)).all()
+
+        async with redis.pipeline(transaction=False) as pipe:
+            for promo_id, max_count, used in rows:
+                remaining = max(max_count - used - pending.get(str(promo_id), 0), 0)
+                pipe.eval(LOWER_SCRIPT, 1, self._key(promo_id), remaining, self.key_ttl)
+            await pipe.execute()
+
+    async def recover(self, db: AsyncSession, redis: Redis) -> None:
+        """
+        Сверка при запуске: счетчик незаписанных активаций пересчитывается по очереди и базе.
+        Счетчики вместимости, заниженные прежним значением, сбрасываются и будут заново посчитаны по базе
+        """
+        lowered = await rebuild_pending(db, redis)
+        if lowered:
+            await redis.delete(*[self._key(promo_id) for promo_id in lowered])
+
+    async def run_reconciler(self, session_maker: async_sessionmaker, redis: Redis) -> None:
+        """
+        Фоновая задача периодической сверки счетчиков
+        """
+        try:
+            async with session_maker() as db:
+                await self.recover(db, redis)
+        except Exception:
+            logger.exception("Pending activations recovery failed")
+
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            try:
+                async with session_maker() as db:
+                    await self.reconcile(db, redis)
+            except Exception:
+                logger.exception("Capacity reconciliation failed")
@@ -0,0 +1,185 @@
+from redis.asyncio import Redis
+from sqlalchemy import delete, insert, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.sql import func
+
+from src.core.config import settings
+from src.models.promo import Promo, PromoActivation, PromoCode
+
+# Атомарное заполнение множества кодов, если пул еще не был инициализирован
+SEED_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    return 0
+end
+if #ARGV > 0 then
+    redis.call('SADD', KEYS[1], unpack(ARGV))
+end
+redis.call('SET', KEYS[2], 1)
+return 1
+"""
+
+# Замена кодов пула после фиксации транзакции. ARGV[1] - количество прежних кодов промокода, за ними прежние
+# коды, затем новый список. Прежние коды, которых нет в инициализированном пуле, уже выданы: их активации могут
+# быть еще не записаны (запрос в процессе или отложенная запись), поэтому такие коды повторно не выдаются
+REFILL_SCRIPT = """
+local previous_count = tonumber(ARGV[1])
+local issued = {}
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    for i = 2, previous_count + 1 do
+        if redis.call('SISMEMBER', KEYS[1], ARGV[i]) == 0 then
+            issued[ARGV[i]] = true
+        end
+    end
+end
+redis.call('DEL', KEYS[1])
+for i = previous_count + 2, #ARGV do
+    if not issued[ARGV[i]] then
+        redis.call('SADD', KEYS[1], ARGV[i])
+    end
+end
+redis.call('SET', KEYS[2], 1)
+return 1
+"""
+
+
+class CodePoolService:
+    """
+    Пул уникальных кодов UNIQUE промокодов.
+    Коды хранятся в таблице promo_codes (выдача через FOR UPDATE SKIP LOCKED)
+    или в множестве Redis (выдача через SPOP) в зависимости от настройки CODE_POOL_BACKEND.
+    Колонка Promo.promo_unique остается исходным списком кодов: при активации она не изменяется
+    и читается только при ленивой инициализации пула
+    """
+
+    def __init__(self):
+        self.backend = settings.code_pool.backend
+
+    @staticmethod
+    def _key(promo_id) -> str:
+        return f"promo:codes:{promo_id}"
+
+    @staticmethod
+    def _seeded_key(promo_id) -> str:
+        return f"promo:codes:{promo_id}:seeded"
+
+    async def fill(self, promo_id, codes: list[str], db: AsyncSession) -> None:
+        """
+        Заполнение пула кодов нового промокода. Для Postgres строки добавляются в текущую транзакцию;
+        пул в Redis заполняется после фиксации транзакции через publish
+        """
+        if self.backend == "redis":
+            return
+
+        await db.flush()
+        if codes:
+            await db.execute(insert(PromoCode), [{"promo_id": promo_id, "value": code} for code in codes])
+
+    async def refill(self, promo: Promo, codes: list[str], db: AsyncSession) -> None:
+        """
+        Замена свободных кодов промокода новым списком в текущей транзакции. Уже выданные коды повторно не выдаются.
+        Строки, захваченные незавершенными активациями, блокируются ими, и DELETE дожидается их фиксации
+        """
+        if self.backend == "redis":
+            return
+
+        await db.execute(
+            delete(PromoCode).where(PromoCode.promo_id == promo.id, PromoCode.claimed_by.is_(None))
+        )
+        claimed = set((await db.execute(
+            select(PromoCode.value).where(PromoCode.promo_id == promo.id)
+        )).scalars().all())
+        await self.fill(promo.id, [code for code in codes if code not in claimed], db)
+
+    async def publish(self, promo: Promo, db: AsyncSession, redis: Redis, previous_codes: list[str] | None = None) -> None:
+        """
+        Запись кодов промокода в пул Redis после фиксации транзакции, чтобы откат не оставлял в пуле
+        чужие коды. previous_codes - коды промокода до изменения (None для нового промокода)
+        """
+        if self.backend != "redis":
+            return
+
+        codes = promo.promo_unique or []
+        if previous_codes is not None:
+            claimed = await self._claimed_values(promo.id, db)
+            codes = [code for code in codes if code not in claimed]
+        else:
+            previous_codes = []
+        await redis.eval(
+            REFILL_SCRIPT, 2, self._key(promo.id), self._seeded_key(promo.id),
+            len(previous_codes), *previous_codes, *codes,
+        )
+
+    async def _claimed_values(self, promo_id, db: AsyncSession) -> set[str]:
+        """
+        Коды промокода, уже выданные пользователям
+        """
+        result = await db.execute(
+            select(PromoActivation.activation_value).where(PromoActivation.promo_id == promo_id)
+        )
+        return set(result.scalars().all())
+
+    async def _seed(self, promo: Promo, db: AsyncSession, redis: Redis) -> None:
+        """
+        Ленивая инициализация пула для промокодов, созданных до появления пула кодов
+        """
+        claimed = await self._claimed_values(promo.id, db)
+        source = (await db.execute(select(Promo.promo_unique).where(Promo.id == promo.id))).scalar()
+        codes = [code for code in (source or []) if code not in claimed]
+
+        if self.backend == "redis":
+            await redis.eval(SEED_SCRIPT, 2, self._key(promo.id), self._seeded_key(promo.id), *codes)
+            return
+
+        # Блокировка на уровне транзакции исключает повторную инициализацию параллельными запросами
+        await db.execute(select(func.pg_advisory_xact_lock(func.hashtext(str(promo.id)))))
+        seeded = (await db.execute(
+            select(select(PromoCode.id).where(PromoCode.promo_id == promo.id).exists())
+        )).scalar()
+        if not seeded and codes:
+            await db.execute(insert(PromoCode), [{"promo_id": promo.id, "value": code} for code in codes])
+
+    async def _claim_once(self, promo_id, user_id: str, db: AsyncSession, redis: Redis) -> str | None:
+        if self.backend == "redis":
+            value = await redis.spop(self._key(promo_id))
+            return value.decode() if value is not None else None
+
+        free_code = (
+            select(PromoCode.id)
+            .where(PromoCode.promo_id == promo_id, PromoCode.claimed_by.is_(None))
+            .limit(1)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        query = (
+            update(PromoCode)
+            .where(PromoCode.id == free_code)
+            .values(claimed_by=user_id, claimed_at=func.now())
+            .returning(PromoCode.value)
+            .execution_options(synchronize_session=False)
+        )
+        return (await db.execute(query)).scalar()
+
+    async def _is_seeded(self, promo_id, db: AsyncSession, redis: Redis) -> bool:
+        if self.backend == "redis":
+            return bool(await redis.exists(self._seeded_key(promo_id)))
+        return (await db.execute(
+            select(select(PromoCode.id).where(PromoCode.promo_id == promo_id).exists())
+        )).scalar()
+
+    async def claim(self, promo: Promo, user_id: str, db: AsyncSession, redis: Redis) -> str | None:
+        """
+        Выдача одного свободного кода промокода. Возвращает None, если коды закончились
+        """
+        value = await self._claim_once(promo.id, user_id, db, redis)
+        if value is None and not await self._is_seeded(promo.id, db, redis):
+            await self._seed(promo, db, redis)
+            value = await self._claim_once(promo.id, user_id, db, redis)
+        return value
+
+    async def release(self, promo_id, value: str, redis: Redis) -> None:
+        """
+        Возврат кода в пул при откате активации. Для Postgres код освобождается откатом транзакции
+        """
+        if self.backend == "redis":
+            await redis.sadd(self._key(promo_id), value)
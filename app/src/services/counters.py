@@ -0,0 +1,89 @@
+import asyncio
+import logging
+
+from sqlalchemy import literal_column
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.future import select
+from sqlalchemy.sql import func
+
+from src.core.config import settings
+from src.models.promo import Promo, PromoCounter, Like, Comment, PromoActivation
+
+logger = logging.getLogger(__name__)
+
+COUNTER_FIELDS = ("like_count", "comment_count", "activation_count")
+
+
+class CounterService:
+    """
+    Денормализованные счетчики лайков, комментариев и активаций промокодов (таблица promo_counters).
+    Изменения выполняются в транзакции вызывающего кода и фиксируются вместе с ней
+    """
+
+    def __init__(self):
+        self.reconcile_interval = settings.counters.reconcile_interval
+
+    async def increment(
+            self,
+            db: AsyncSession,
+            promo_id,
+            like_count: int = 0,
+            comment_count: int = 0,
+            activation_count: int = 0,
+    ) -> None:
+        await self.increment_many(db, [{
+            "promo_id": promo_id,
+            "like_count": like_count,
+            "comment_count": comment_count,
+            "activation_count": activation_count,
+        }])
+
+    async def increment_many(self, db: AsyncSession, deltas: list[dict]) -> None:
+        """
+        Изменение счетчиков нескольких промокодов одной командой.
+        Каждый элемент: promo_id и приращения счетчиков (отсутствующие считаются нулевыми)
+        """
+        if not deltas:
+            return
+        rows = [{"promo_id": delta["promo_id"], **{field: delta.get(field, 0) for field in COUNTER_FIELDS}} for delta in deltas]
+        statement = insert(PromoCounter).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=[PromoCounter.promo_id],
+            set_={field: getattr(PromoCounter, field) + getattr(statement.excluded, field) for field in COUNTER_FIELDS},
+        )
+        await db.execute(statement)
+
+    async def reconcile(self, db: AsyncSession) -> None:
+        """
+        Пересчет счетчиков по исходным таблицам. Строки обновляются только при расхождении.
+        Изменения, зафиксированные во время пересчета, могут дать временное расхождение,
+        которое исправляется следующим запуском
+        """
+        def count(model):
+            return select(func.count()).where(model.promo_id == Promo.id).scalar_subquery()
+
+        source = select(Promo.id, count(Like), count(Comment), count(PromoActivation))
+        statement = insert(PromoCounter).from_select(["promo_id", *COUNTER_FIELDS], source)
+        statement = statement.on_conflict_do_update(
+            index_elements=[PromoCounter.promo_id],
+            set_={field: getattr(statement.excluded, field) for field in COUNTER_FIELDS},
+            where=(
+                literal_column("(promo_counters.like_count, promo_counters.comment_count, promo_counters.activation_count)")
+                .is_distinct_from(literal_column("(excluded.like_count, excluded.comment_count, excluded.activation_count)"))
+            ),
+        )
+        await db.execute(statement)
+        await db.commit()
+
+    async def run_reconciler(self, session_maker: async_sessionmaker) -> None:
+        """
+        Фоновая задача периодической сверки счетчиков
+        """
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            try:
+                async with session_maker() as db:
+                    await self.reconcile(db)
+            except Exception:
+                logger.exception("Promo counters reconciliation failed")
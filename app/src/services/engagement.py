@@ -0,0 +1,54 @@
+from redis.asyncio import Redis
+from sqlalchemy import exists
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.sql import func
+
+from src.models.promo import Promo, PromoCounter, PromoActivation, Like
+from src.services.likes import LikeService
+
+
+class EngagementService:
+    """
+    Социальные данные карточек промокодов: количество лайков и комментариев, лайк и активация
+    текущего пользователя. Считаются для всей страницы одним запросом к базе и одним
+    конвейером команд Redis
+    """
+
+    def __init__(self, likes: LikeService):
+        self.likes = likes
+
+    async def enrich(self, cards: list[dict], user_id, db: AsyncSession, redis: Redis) -> list[dict]:
+        """
+        Дополнение карточек полями like_count, comment_count, is_liked_by_user и is_activated_by_user.
+        В режиме write-behind активация появляется в карточке после записи пакета
+        """
+        promo_ids = [str(card["id"]) for card in cards]
+        if not promo_ids:
+            return cards
+
+        query = (
+            select(
+                Promo.id,
+                func.coalesce(PromoCounter.like_count, 0),
+                func.coalesce(PromoCounter.comment_count, 0),
+                exists().where(Like.promo_id == Promo.id, Like.user_id == user_id),
+                exists().where(PromoActivation.promo_id == Promo.id, PromoActivation.user_id == user_id),
+            )
+            .outerjoin(PromoCounter, PromoCounter.promo_id == Promo.id)
+            .where(Promo.id.in_(promo_ids))
+        )
+        stats = {str(row[0]): row[1:] for row in (await db.execute(query)).all()}
+
+        # Лайки, еще не записанные в базу, учитываются по множествам в Redis
+        buffered = await self.likes.snapshot(promo_ids, user_id, redis)
+
+        for promo_id, card in zip(promo_ids, cards):
+            like_count, comment_count, liked, activated = stats.get(promo_id, (0, 0, False, False))
+            if promo_id in buffered:
+                like_count, liked = buffered[promo_id]
+            card["like_count"] = like_count
+            card["comment_count"] = comment_count
+            card["is_liked_by_user"] = liked
+            card["is_activated_by_user"] = activated
+        return cards
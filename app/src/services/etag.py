@@ -0,0 +1,73 @@
+import hashlib
+from typing import Iterable
+
+from redis.asyncio import Redis
+
+from src.core.config import settings
+
+
+class EtagService:
+    """
+    Слабые ETag промокодов для условных GET-запросов.
+    Значение вычисляется по данным, от которых зависит ответ (updated_at, счетчики, комментарии),
+    и сохраняется в Redis, чтобы запрос с совпадающим If-None-Match получал 304 без обращения к базе.
+    Изменения промокода, лайков, комментариев и активаций удаляют сохраненные значения
+    """
+
+    def __init__(self):
+        self.enabled = settings.etag.enabled
+        self.ttl = settings.etag.ttl
+
+    @staticmethod
+    def _key(promo_id) -> str:
+        return f"promo:etag:{promo_id}"
+
+    @staticmethod
+    def make(*parts) -> str:
+        """
+        ETag по значениям, от которых зависит ответ
+        """
+        digest = hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest()
+        return f'W/"{digest[:20]}"'
+
+    @staticmethod
+    def matches(if_none_match: str | None, etag: str | None) -> bool:
+        """
+        Слабое сравнение ETag со значениями заголовка If-None-Match
+        """
+        if not if_none_match or not etag:
+            return False
+        candidates = {value.strip().removeprefix("W/") for value in if_none_match.split(",")}
+        return "*" in candidates or etag.removeprefix("W/") in candidates
+
+    async def get(self, promo_id, resource: str, redis: Redis, company_id: str | None = None) -> str | None:
+        """
+        Сохраненный ETag ресурса промокода. Если передан company_id, значение возвращается
+        только компании-владельцу, остальные получают ответ (и ошибку доступа) обычным путем
+        """
+        if not self.enabled:
+            return None
+        owner, etag = await redis.hmget(self._key(promo_id), "company_id", resource)
+        if etag is None or (company_id is not None and (owner or b"").decode() != str(company_id)):
+            return None
+        return etag.decode()
+
+    async def set(self, promo_id, resource: str, etag: str, redis: Redis, company_id=None) -> None:
+        if not self.enabled:
+            return
+        mapping = {resource: etag}
+        if company_id is not None:
+            mapping["company_id"] = str(company_id)
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.hset(self._key(promo_id), mapping=mapping)
+            pipe.expire(self._key(promo_id), self.ttl)
+            await pipe.execute()
+
+    async def invalidate(self, redis: Redis, promo_ids: Iterable) -> None:
+        """
+        Удаление сохраненных ETag промокодов после их изменения.
+        Чтение, начатое до изменения, может успеть сохранить прежнее значение; оно живет не дольше ETAG_TTL
+        """
+        keys = [self._key(promo_id) for promo_id in promo_ids]
+        if self.enabled and keys:
+            await redis.delete(*keys)
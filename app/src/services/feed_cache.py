@@ -0,0 +1,139 @@
+import hashlib
+import json
+from typing import Iterable, NamedTuple
+
+from redis.asyncio import Redis
+
+from src.core.config import settings
+from src.core.serialization import dumps
+
+# Номер поколения кеша; увеличивается при каждой инвалидации
+GENERATION_KEY = "feed:generation"
+
+# Сохранение страницы и ее тегов. Страница не сохраняется, если с начала ее расчета прошла инвалидация:
+# иначе в кеш могли бы попасть данные, прочитанные из базы до изменения промокода
+SET_SCRIPT = """
+if (redis.call('GET', KEYS[1]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('HSET', KEYS[2], 'body', ARGV[4], 'total_count', ARGV[5], 'next_cursor', ARGV[6])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+for i = 3, #KEYS do
+    redis.call('SADD', KEYS[i], KEYS[2])
+    redis.call('EXPIRE', KEYS[i], ARGV[3])
+end
+return 1
+"""
+
+# Удаление всех страниц, помеченных переданными тегами, вместе с самими тегами
+INVALIDATE_SCRIPT = """
+redis.call('INCR', KEYS[1])
+local deleted = 0
+for i = 2, #KEYS do
+    local pages = redis.call('SMEMBERS', KEYS[i])
+    for _, page in ipairs(pages) do
+        deleted = deleted + redis.call('DEL', page)
+    end
+    redis.call('DEL', KEYS[i])
+end
+return deleted
+"""
+
+
+class FeedPage(NamedTuple):
+    """
+    Готовая страница ленты: сериализованное тело ответа и значения заголовков
+    """
+    body: bytes
+    total_count: int | None
+    next_cursor: str | None
+
+
+class FeedCache:
+    """
+    Кеш страниц ленты в Redis по сегменту (страна, поиск, курсор, размер страницы).
+    Страница помечается тегами промокодов на ней и страны сегмента; изменения промокодов
+    удаляют все страницы с соответствующими тегами
+    """
+
+    def __init__(self):
+        self.enabled = settings.feed_cache.enabled
+        self.ttl = settings.feed_cache.ttl
+
+    @staticmethod
+    def key(country: str | None, search: str | None, limit: int, cursor: str | None) -> str:
+        raw = json.dumps([country.lower() if country else None, search or None, limit, cursor or None])
+        return "feed:page:" + hashlib.sha1(raw.encode()).hexdigest()
+
+    @staticmethod
+    def _country_tag(country: str | None) -> str:
+        # Страницы без фильтра по стране помечаются общим тегом
+        return f"feed:tag:country:{country.lower() if country else '*'}"
+
+    @staticmethod
+    def _promo_tag(promo_id) -> str:
+        return f"feed:tag:promo:{promo_id}"
+
+    @staticmethod
+    def render(promos: list[dict]) -> bytes:
+        """
+        Сериализация карточек ленты в тело ответа
+        """
+        return dumps(promos)
+
+    async def generation(self, redis: Redis) -> str:
+        """
+        Текущее поколение кеша; запоминается до чтения страницы из базы
+        """
+        value = await redis.get(GENERATION_KEY)
+        return value.decode() if value else "0"
+
+    async def get(self, key: str, redis: Redis) -> FeedPage | None:
+        cached = await redis.hgetall(key)
+        if not cached:
+            return None
+        return FeedPage(
+            body=cached[b"body"],
+            total_count=int(cached[b"total_count"]) if cached[b"total_count"] else None,
+            next_cursor=cached[b"next_cursor"].decode() or None,
+        )
+
+    async def set(
+            self,
+            key: str,
+            page: FeedPage,
+            generation: str,
+            ttl: int,
+            country: str | None,
+            promo_ids: Iterable,
+            redis: Redis,
+    ) -> bool:
+        """
+        Сохранение страницы с тегами страны и промокодов. Возвращает False, если страница устарела
+        """
+        tags = [self._country_tag(country)] + [self._promo_tag(promo_id) for promo_id in promo_ids]
+        result = await redis.eval(
+            SET_SCRIPT,
+            2 + len(tags),
+            GENERATION_KEY,
+            key,
+            *tags,
+            generation,
+            ttl,
+            self.ttl,
+            page.body,
+            "" if page.total_count is None else page.total_count,
+            page.next_cursor or "",
+        )
+        return result == 1
+
+    async def invalidate(self, redis: Redis, promo_ids: Iterable = (), countries: Iterable = ()) -> None:
+        """
+        Удаление страниц с промокодами promo_ids и страниц сегментов стран countries.
+        Страна None означает страницы без фильтра по стране
+        """
+        tags = {self._promo_tag(promo_id) for promo_id in promo_ids}
+        tags |= {self._country_tag(country) for country in countries}
+        if not self.enabled or not tags:
+            return
+        await redis.eval(INVALIDATE_SCRIPT, 1 + len(tags), GENERATION_KEY, *tags)
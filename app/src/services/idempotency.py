@@ -0,0 +1,87 @@
+import asyncio
+import json
+from typing import Awaitable, Callable
+
+from fastapi import HTTPException, status
+from redis.asyncio import Redis
+
+from src.core.config import settings
+
+# Маркер запроса, который еще выполняется
+IN_PROGRESS = b"__in_progress__"
+
+
+class IdempotencyService:
+    """
+    Повторное использование результата запроса с тем же Idempotency-Key.
+    Первый запрос выполняется и его ответ сохраняется в Redis, параллельные дубликаты
+    дожидаются этого ответа, а не выполняются повторно
+    """
+
+    def __init__(self):
+        self.ttl = settings.idempotency.ttl
+        self.lock_ttl = settings.idempotency.lock_ttl
+        self.wait_timeout = settings.idempotency.wait_timeout
+        self.poll_interval = settings.idempotency.poll_interval
+
+    @staticmethod
+    def _replay(cached: bytes) -> dict:
+        """
+        Воспроизведение сохраненного ответа
+        """
+        data = json.loads(cached)
+        if data["status_code"] >= 400:
+            raise HTTPException(status_code=data["status_code"], detail=data["detail"])
+        return data["body"]
+
+    async def execute(self, scope: str, key: str, redis: Redis, handler: Callable[[], Awaitable[dict]]) -> dict:
+        """
+        Выполнение обработчика не более одного раза для пары (scope, key)
+        """
+        if len(key) > 255:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Idempotency-Key must not exceed 255 characters."
+            )
+
+        cache_key = f"idempotency:{scope}:{key}"
+        deadline = asyncio.get_running_loop().time() + self.wait_timeout
+
+        while True:
+            if await redis.set(cache_key, IN_PROGRESS, nx=True, ex=self.lock_ttl):
+                break
+
+            cached = await redis.get(cache_key)
+            if cached is not None and cached != IN_PROGRESS:
+                return self._replay(cached)
+
+            # Если исходный запрос завершился временной ошибкой, ключ удален и запрос выполнится заново
+            if cached is None:
+                continue
+
+            if asyncio.get_running_loop().time() >= deadline:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="A request with this Idempotency-Key is still being processed."
+                )
+            await asyncio.sleep(self.poll_interval)
+
+        try:
+            result = await handler()
+        except HTTPException as exc:
+            # Ошибки клиента сохраняются, серверные ошибки позволяют повторить запрос
+            if exc.status_code < 500:
+                await redis.set(
+                    cache_key,
+                    json.dumps({"status_code": exc.status_code, "detail": exc.detail}),
+                    ex=self.ttl,
+                )
+            else:
+                await redis.delete(cache_key)
+            raise
+        except BaseException:
+            await redis.delete(cache_key)
+            raise
+
+        await redis.set(cache_key, json.dumps({"status_code": status.HTTP_200_OK, "body": result}), ex=self.ttl)
+        return result
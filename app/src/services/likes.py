@@ -0,0 +1,298 @@
+import asyncio
+import logging
+from collections import Counter
+from uuid import uuid4
+
+from fastapi import HTTPException, status
+from redis.asyncio import Redis
+from sqlalchemy import delete, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.future import select
+
+from src.core.config import settings
+from src.models.promo import Promo, Like
+from src.services.counters import CounterService
+
+logger = logging.getLogger(__name__)
+
+# Изменения лайков, еще не записанные в базу: поле "{promo_id}:{user_id}", значение 1 - лайк, 0 - снятие
+PENDING_KEY = "promo:likes:pending"
+# Изменения, которые записываются сейчас (или не были записаны из-за ошибки)
+FLUSHING_KEY = "promo:likes:flushing"
+# Количество неудачных попыток записать текущие изменения
+FLUSH_ATTEMPTS_KEY = "promo:likes:flushing:attempts"
+# Изменения, которые не удалось записать и построчно: отложены для разбора, запись остальных не блокируют
+PARKED_KEY = "promo:likes:parked"
+# Блокировка записи, чтобы изменения записывал только один воркер
+FLUSH_LOCK_KEY = "promo:likes:flush_lock"
+
+# Служебный элемент множества: отличает загруженное множество без лайков от незагруженного
+LOADED_MARKER = "*"
+
+# Установка или снятие лайка: -1 - множество не загружено, 0 - состояние не изменилось, 1 - изменилось.
+# Изменение попадает в очередь записи вместе с изменением множества
+TOGGLE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return -1
+end
+local changed
+if ARGV[2] == '1' then
+    changed = redis.call('SADD', KEYS[1], ARGV[1])
+else
+    changed = redis.call('SREM', KEYS[1], ARGV[1])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+if changed == 1 then
+    redis.call('HSET', KEYS[2], ARGV[3], ARGV[2])
+end
+return changed
+"""
+
+# Загрузка множества лайков из базы, если его еще нет
+LOAD_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    redis.call('SADD', KEYS[1], unpack(ARGV, 2))
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return 1
+"""
+
+# Снятие блокировки только ее владельцем: блокировка могла истечь и достаться другому воркеру
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class LikeService:
+    """
+    Лайки промокодов. Множество лайкнувших пользователей хранится в Redis и отвечает на запросы
+    количества лайков и лайка пользователя; изменения копятся в Redis и пакетно записываются
+    в таблицу likes (INSERT ... ON CONFLICT DO NOTHING и DELETE) вместе со счетчиками.
+    Без отложенной записи лайк сразу записывается в базу теми же командами
+    """
+
+    def __init__(self):
+        self.enabled = settings.likes.enabled
+        self.batch_size = settings.likes.batch_size
+        self.flush_interval = settings.likes.flush_interval
+        self.max_flush_attempts = settings.likes.max_flush_attempts
+        self.key_ttl = settings.likes.key_ttl
+        self.counters = CounterService()
+        self.session_maker: async_sessionmaker | None = None
+        self.redis: Redis | None = None
+        self._task: asyncio.Task | None = None
+
+    @staticmethod
+    def _key(promo_id) -> str:
+        return f"promo:likes:{promo_id}"
+
+    async def start(self, session_maker: async_sessionmaker, redis: Redis) -> None:
+        """
+        Запуск фоновой записи лайков в базу
+        """
+        if not self.enabled:
+            return
+        self.session_maker = session_maker
+        self.redis = redis
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Остановка с записью накопленных изменений
+        """
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.flush()
+
+    async def _load(self, promo_id, db: AsyncSession, redis: Redis) -> None:
+        """
+        Загрузка лайков промокода из базы. Отсутствующий промокод - ошибка 404
+        """
+        rows = (await db.execute(
+            select(Promo.id, Like.user_id)
+            .outerjoin(Like, Like.promo_id == Promo.id)
+            .where(Promo.id == promo_id)
+        )).all()
+        if not rows:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Promo not found.")
+        members = [str(user_id) for _, user_id in rows if user_id is not None]
+        await redis.eval(LOAD_SCRIPT, 1, self._key(promo_id), self.key_ttl, LOADED_MARKER, *members)
+
+    async def set_like(self, promo_id, user_id, liked: bool, db: AsyncSession, redis: Redis) -> bool:
+        """
+        Установка или снятие лайка пользователя. Возвращает False, если состояние не изменилось
+        """
+        if not self.enabled:
+            return await self._write_now(promo_id, user_id, liked, db)
+
+        args = (str(user_id), "1" if liked else "0", f"{promo_id}:{user_id}", self.key_ttl)
+        result = await redis.eval(TOGGLE_SCRIPT, 2, self._key(promo_id), PENDING_KEY, *args)
+        if result == -1:
+            await self._load(promo_id, db, redis)
+            result = await redis.eval(TOGGLE_SCRIPT, 2, self._key(promo_id), PENDING_KEY, *args)
+        return result == 1
+
+    async def _write_now(self, promo_id, user_id, liked: bool, db: AsyncSession) -> bool:
+        """
+        Запись лайка в базу в транзакции запроса
+        """
+        if not await db.scalar(select(Promo.id).where(Promo.id == promo_id)):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Promo not found.")
+        if liked:
+            changed = await self._insert(db, [(promo_id, user_id)])
+        else:
+            changed = await self._delete(db, [(promo_id, user_id)])
+        if changed:
+            await self.counters.increment(db, promo_id, like_count=1 if liked else -1)
+        await db.commit()
+        return bool(changed)
+
+    async def count(self, promo_id, db: AsyncSession, redis: Redis) -> int | None:
+        """
+        Количество лайков промокода из Redis; None, если лайки хранятся только в базе
+        """
+        if not self.enabled:
+            return None
+        key = self._key(promo_id)
+        if not await redis.exists(key):
+            await self._load(promo_id, db, redis)
+        return max(await redis.scard(key) - 1, 0)
+
+    async def is_liked(self, promo_id, user_id, db: AsyncSession, redis: Redis) -> bool:
+        """
+        Поставил ли пользователь лайк промокоду
+        """
+        if not self.enabled:
+            return bool(await db.scalar(
+                select(Like.id).where(Like.promo_id == promo_id, Like.user_id == user_id)
+            ))
+        key = self._key(promo_id)
+        if not await redis.exists(key):
+            await self._load(promo_id, db, redis)
+        return bool(await redis.sismember(key, str(user_id)))
+
+    async def snapshot(self, promo_ids: list[str], user_id, redis: Redis) -> dict[str, tuple[int, bool]]:
+        """
+        Количество лайков и лайк пользователя по загруженным в Redis множествам промокодов.
+        Промокоды без загруженного множества в результат не попадают: их лайки уже записаны в базу
+        """
+        if not self.enabled or not promo_ids:
+            return {}
+        async with redis.pipeline(transaction=False) as pipe:
+            for promo_id in promo_ids:
+                pipe.scard(self._key(promo_id))
+                pipe.sismember(self._key(promo_id), str(user_id))
+            values = await pipe.execute()
+
+        result = {}
+        for promo_id, count, liked in zip(promo_ids, values[::2], values[1::2]):
+            if count:
+                result[promo_id] = (count - 1, bool(liked))
+        return result
+
+    @staticmethod
+    async def _insert(db: AsyncSession, pairs: list[tuple]) -> list:
+        """
+        Вставка лайков без дубликатов. Возвращает promo_id фактически вставленных строк
+        """
+        if not pairs:
+            return []
+        statement = (
+            insert(Like)
+            .values([{"promo_id": promo_id, "user_id": user_id} for promo_id, user_id in pairs])
+            .on_conflict_do_nothing(index_elements=[Like.promo_id, Like.user_id])
+            .returning(Like.promo_id)
+        )
+        return (await db.execute(statement)).scalars().all()
+
+    @staticmethod
+    async def _delete(db: AsyncSession, pairs: list[tuple]) -> list:
+        """
+        Удаление лайков. Возвращает promo_id фактически удаленных строк
+        """
+        if not pairs:
+            return []
+        statement = (
+            delete(Like)
+            .where(tuple_(Like.promo_id, Like.user_id).in_(pairs))
+            .returning(Like.promo_id)
+        )
+        return (await db.execute(statement)).scalars().all()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush promo likes")
+
+    async def flush(self) -> None:
+        """
+        Запись накопленных изменений лайков в базу. Изменения, которые не удалось записать,
+        остаются в Redis и записываются следующим запуском раньше новых. После max_flush_attempts
+        неудачных попыток изменения записываются построчно, а строки с ошибкой откладываются в PARKED_KEY
+        """
+        token = uuid4().hex
+        if not await self.redis.set(FLUSH_LOCK_KEY, token, nx=True, ex=max(int(self.flush_interval * 30), 30)):
+            return
+        try:
+            if not await self.redis.exists(FLUSHING_KEY):
+                if not await self.redis.exists(PENDING_KEY):
+                    return
+                await self.redis.rename(PENDING_KEY, FLUSHING_KEY)
+
+            changes = await self.redis.hgetall(FLUSHING_KEY)
+            try:
+                await self._write(changes)
+            except Exception:
+                if await self.redis.incr(FLUSH_ATTEMPTS_KEY) < self.max_flush_attempts:
+                    raise
+                logger.exception("Failed to flush %d promo like changes, writing them one by one", len(changes))
+                await self._write_each(changes)
+
+            await self.redis.delete(FLUSHING_KEY, FLUSH_ATTEMPTS_KEY)
+        finally:
+            await self.redis.eval(RELEASE_LOCK_SCRIPT, 1, FLUSH_LOCK_KEY, token)
+
+    async def _write(self, changes: dict) -> None:
+        """
+        Запись изменений лайков пакетами в одной транзакции вместе со счетчиками
+        """
+        liked, unliked = [], []
+        for field, value in changes.items():
+            promo_id, user_id = field.decode().split(":")
+            (liked if value == b"1" else unliked).append((promo_id, user_id))
+
+        async with self.session_maker() as db:
+            deltas = Counter()
+            for start in range(0, len(liked), self.batch_size):
+                deltas.update(await self._insert(db, liked[start:start + self.batch_size]))
+            for start in range(0, len(unliked), self.batch_size):
+                deltas.subtract(await self._delete(db, unliked[start:start + self.batch_size]))
+            await self.counters.increment_many(db, [
+                {"promo_id": promo_id, "like_count": delta} for promo_id, delta in deltas.items() if delta
+            ])
+            await db.commit()
+
+    async def _write_each(self, changes: dict) -> None:
+        """
+        Построчная запись изменений, чтобы одна ошибочная строка (например, удаленный промокод)
+        не блокировала запись остальных
+        """
+        for field, value in changes.items():
+            try:
+                await self._write({field: value})
+            except Exception:
+                logger.exception("Failed to write promo like change %s, parking it", field.decode())
+                await self.redis.hset(PARKED_KEY, field, value)
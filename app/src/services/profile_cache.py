@@ -0,0 +1,139 @@
+import asyncio
+import json
+import logging
+from datetime import datetime
+from typing import NamedTuple
+
+from redis.asyncio import Redis
+
+from src.core.cache import TTLCache
+from src.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Канал Redis, через который воркеры узнают об изменении профилей
+INVALIDATION_CHANNEL = "profile:invalidate"
+
+# Сохранение профиля, если с момента чтения из базы не было инвалидации:
+# иначе в кеш вернулись бы данные, прочитанные до изменения профиля
+SET_SCRIPT = """
+if (redis.call('GET', KEYS[1]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+# Увеличение поколения профиля и удаление записи из Redis
+INVALIDATE_SCRIPT = """
+redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+redis.call('DEL', KEYS[2])
+"""
+
+
+class ProfileGeneration(NamedTuple):
+    """
+    Поколение профиля, запомненное до чтения из базы: номер в Redis
+    и число инвалидаций, полученных этим воркером
+    """
+    redis: str
+    local: int
+
+
+class ProfileCache:
+    """
+    Кеш профилей пользователей: память процесса и Redis.
+    Изменение профиля публикует сообщение, по которому все воркеры сбрасывают локальную копию
+    """
+
+    def __init__(self):
+        self.redis_ttl = settings.profile_cache.redis_ttl
+        self.local = TTLCache(maxsize=settings.profile_cache.local_size, ttl=settings.profile_cache.local_ttl)
+        # Счетчик инвалидаций в процессе: локальная копия не сохраняется, если он изменился во время чтения
+        self._local_generation = 0
+
+    @staticmethod
+    def _key(user_id) -> str:
+        return f"profile:{user_id}"
+
+    @staticmethod
+    def _generation_key(user_id) -> str:
+        return f"profile:{user_id}:generation"
+
+    @staticmethod
+    def _encode(value):
+        # Даты сохраняются в том же ISO-формате, в котором их отдает FastAPI
+        if isinstance(value, datetime):
+            return value.isoformat()
+        return str(value)
+
+    def _invalidate_local(self, user_id: str) -> None:
+        self._local_generation += 1
+        self.local.delete(user_id)
+
+    async def get(self, user_id: str, redis: Redis) -> dict | None:
+        profile = self.local.get(str(user_id))
+        if profile is not None:
+            return profile
+
+        local_generation = self._local_generation
+        cached = await redis.get(self._key(user_id))
+        if cached is None:
+            return None
+        profile = json.loads(cached)
+        if local_generation == self._local_generation:
+            self.local.set(str(user_id), profile)
+        return profile
+
+    async def generation(self, user_id: str, redis: Redis) -> ProfileGeneration:
+        """
+        Текущее поколение профиля; запоминается до чтения профиля из базы
+        """
+        local_generation = self._local_generation
+        value = await redis.get(self._generation_key(user_id))
+        return ProfileGeneration(redis=value.decode() if value else "0", local=local_generation)
+
+    async def set(self, user_id: str, profile: dict, generation: ProfileGeneration, redis: Redis) -> dict:
+        """
+        Сохранение профиля в кеш, если с момента чтения generation профиль не инвалидировался.
+        Возвращает профиль в том виде, в котором он хранится в кеше
+        """
+        raw = json.dumps(profile, default=self._encode)
+        stored = await redis.eval(
+            SET_SCRIPT, 2, self._generation_key(user_id), self._key(user_id), generation.redis, raw, self.redis_ttl
+        )
+        profile = json.loads(raw)
+        if stored == 1 and generation.local == self._local_generation:
+            self.local.set(str(user_id), profile)
+        return profile
+
+    async def invalidate(self, user_id: str, redis: Redis) -> None:
+        self._invalidate_local(str(user_id))
+        # Поколение живет не меньше записи профиля, иначе запоздавшая запись могла бы совпасть с ним после сброса
+        await redis.eval(
+            INVALIDATE_SCRIPT, 2, self._generation_key(user_id), self._key(user_id), self.redis_ttl * 2
+        )
+        await redis.publish(INVALIDATION_CHANNEL, str(user_id))
+
+    async def run_listener(self, redis: Redis) -> None:
+        """
+        Фоновая задача, сбрасывающая локальные копии профилей по сообщениям других воркеров
+        """
+        while True:
+            pubsub = redis.pubsub()
+            try:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                # Сообщения, пропущенные до подписки, могли устареть
+                self._local_generation += 1
+                self.local.clear()
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self._invalidate_local(message["data"].decode())
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Profile invalidation listener failed, resubscribing")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
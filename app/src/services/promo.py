@@ -1,33 +1,82 @@
-from typing import Optional
-from uuid import uuid4
+from typing import AsyncIterator, Awaitable, Callable, Optional
+import json
+from uuid import UUID, uuid4
 import re
-from datetime import datetime, timezone, timedelta
+from datetime import datetime
 import pycountry
+import anyio
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy.exc import IntegrityError, DataError
 from sqlalchemy.sql import func
-from sqlalchemy import or_, and_
-from sqlalchemy.orm import joinedload
+from sqlalchemy import or_, and_, tuple_, update, literal
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import joinedload, load_only, undefer
 from redis.asyncio import Redis
 
 from fastapi import HTTPException, status
 
 from src.core.config import settings
-from src.models.promo import Promo, PromoActivation, Comment, Like
+from src.core import serialization
+from src.db.postgres import async_session_maker
+from src.core.pagination import (
+    encode_cursor, decode_cursor, parse_cursor_datetime, parse_cursor_uuid, count_rows,
+)
+from src.models.promo import Promo, PromoActivation, PromoCounter, Comment
+from src.models.user import User
 from src.services.user import UserService
 from src.services.antifraud import AntifraudService
+from src.services.capacity import CapacityService
+from src.services.counters import CounterService
+from src.services.etag import EtagService
+from src.services.likes import LikeService
+from src.services.engagement import EngagementService
+from src.services.code_pool import CodePoolService
+from src.services.activation_writer import ActivationWriter
+from src.services.targeting import TargetingService
+from src.services.promo_index import ActivePromoIndex, current_time
+from src.services.feed_cache import FeedCache, FeedPage
 
 user_service = UserService()
-antifraud_service = AntifraudService(antifraud_address=settings.antifraud)
+antifraud_service = AntifraudService(antifraud_address=settings.antifraud.address)
+capacity_service = CapacityService()
+counter_service = CounterService()
+etag_service = EtagService()
+like_service = LikeService()
+engagement_service = EngagementService(like_service)
+code_pool_service = CodePoolService()
+activation_writer = ActivationWriter()
+targeting_service = TargetingService()
+promo_index = ActivePromoIndex()
+feed_cache = FeedCache()
+
+# Поля, которые можно менять пакетным редактированием. Коды UNIQUE промокодов (promo_unique)
+# и режим меняются только по одному: для них нужно перестраивать пул кодов
+BULK_UPDATE_FIELDS = {"description", "image_url", "target", "max_count", "active_from", "active_until", "active", "promo_common"}
+# Ограничение размера пакета: идентификаторы передаются параметрами запроса
+BULK_UPDATE_MAX_ITEMS = 10000
+# Допустимые типы значений полей промокода и сообщение об ошибке; None очищает необязательное поле
+FIELD_TYPES = {
+    "description": ((str,), "Description must be a string."),
+    "target": ((dict,), "Target must be an object."),
+    "max_count": ((int,), "Max_count must be an integer."),
+    "active_from": ((str, type(None)), "Active_from must be a string or null."),
+    "active_until": ((str, type(None)), "Active_until must be a string or null."),
+    "active": ((bool,), "Active must be a boolean."),
+    "mode": ((str,), "Mode must be a string."),
+    "promo_common": ((str, type(None)), "Promo_common must be a string or null."),
+    "promo_unique": ((list, type(None)), "Promo_unique must be a list of strings or null."),
+}
+# Верхняя граница max_count: колонка INTEGER
+MAX_COUNT_LIMIT = 2 ** 31 - 1
 
 class PromoService:
 
     def __init__(self):
         self.iso_3166_regex = re.compile(r"^[a-z]{2}$")
 
-    async def promo_create(self, body: dict, db: AsyncSession, company_id: str) -> dict:
+    async def promo_create(self, body: dict, db: AsyncSession, redis: Redis, company_id: str) -> dict:
         """
         Создание компанией нового промокода
         POST /business/promo
@@ -64,7 +113,13 @@ class PromoService:
 
         try:
             db.add(promo)
+            if promo.mode == "UNIQUE":
+                await code_pool_service.fill(promo.id, promo.promo_unique or [], db)
             await db.commit()
+            if promo.mode == "UNIQUE":
+                await code_pool_service.publish(promo, db, redis)
+            promo_index.upsert(promo)
+            await feed_cache.invalidate(redis, countries=[(promo.target or {}).get("country"), None])
             return {"id": promo.id}
         except IntegrityError:
             await db.rollback()
@@ -89,84 +144,180 @@ class PromoService:
         Получение списка промокодов компании
         GET /business/promo
         """
-        base_query = select(Promo).where(Promo.company_id == company_id)
-
-        # Фильтрация по странам
-        if country_param := params.get("country"):
-            countries = [c.strip().lower() for c in country_param.split(",")]
-            country_filters = [Promo.target.op("@>")({"country": country}) for country in countries]
-            base_query = base_query.filter(
-                or_(
-                    *country_filters,
-                    Promo.target == {},
-                    Promo.target.is_(None)
-                )
-            )
-
-        # Подсчет общего количества записей
-        total_query = select(func.count()).select_from(base_query.subquery())
-        total_count = (await db.execute(total_query)).scalar()
-
-        # Сортировка
-        sort_field = {
-            "active_from": Promo.active_from,
-            "active_until": Promo.active_until,
-            "created_at": Promo.created_at,
-        }.get(params.get("sort_by"), Promo.created_at)
-        base_query = base_query.order_by(sort_field.desc())
-
-        # Пагинация
+        query, filter_query, sort_key = self._business_list_query(company_id, params)
         offset = int(params.get("offset", 0))
         limit = int(params.get("limit", 10))
-        paginated_query = base_query.offset(offset).limit(limit)
-
-        # Получение данных
-        promos = (await db.execute(paginated_query)).scalars().all()
-
-        # Преобразование данных в словари
-        promos_dicts = [
-            {
-                "id": str(promo.id),
-                "description": promo.description,
-                "image_url": promo.image_url,
-                "target": promo.target if promo.target else {},
-                "max_count": promo.max_count,
-                "active_from": promo.active_from.strftime('%Y-%m-%d') if promo.active_from else None,
-                "active_until": promo.active_until.strftime('%Y-%m-%d') if promo.active_until else None,
-                "mode": promo.mode,
-                "promo_common": promo.promo_common,
-                "promo_unique": promo.promo_unique,
-                "created_at": promo.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-            }
-            for promo in promos
-        ]
+
+        rows, total_count = await self._fetch_page(db, query, filter_query, offset, limit, params.get("cursor"))
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor([self._business_sort_by(params), *rows[-1][1:len(sort_key) + 1]])
 
         return {
             "total_count": total_count,
-            "promos": promos_dicts,
+            "promos": [serialization.business_promo(row[0]) for row in rows],
+            "next_cursor": next_cursor,
         }
 
-    async def promo_get_by_id(self, promo_id: int, db: AsyncSession, company_id: str) -> dict:
+    async def promo_get_list_stream(
+            self, company_id: str, params: dict,
+    ) -> tuple[int | None, str | None, AsyncIterator[dict]]:
         """
-        Получение данных промокода по его ID. Сервер должен проверять принадлежность промокода компании
-        GET /business/promo/{id}
+        Потоковое получение списка промокодов компании
+        GET /business/promo с Accept: application/x-ndjson или application/json; stream=true
+        Возвращает общее количество, курсор следующей страницы и итератор промокодов
         """
-        # Получение промокода из базы данных
-        query = (
-            select(Promo)
-            .options(
-                joinedload(Promo.company),  # Загрузка связанных данных о компании
-                joinedload(Promo.likes),   # Загрузка лайков
-                joinedload(Promo.comments)  # Загрузка комментариев
-            )
-            .where(Promo.id == promo_id)
+        query, filter_query, sort_key = self._business_list_query(company_id, params)
+        items = self._stream_page(
+            query, filter_query, sort_key,
+            offset=int(params.get("offset", 0)),
+            limit=int(params.get("limit", 10)),
+            cursor=params.get("cursor"),
+            convert=serialization.business_promo,
+            prefix=[self._business_sort_by(params)],
+            options=[undefer(Promo.promo_unique)],
         )
+        total_count, next_cursor = await anext(items)
+        return total_count, next_cursor, items
+
+    @staticmethod
+    def _business_sort_by(params: dict) -> str:
+        return params.get("sort_by") or "created_at"
+
+    def _business_list_query(self, company_id: str, params: dict) -> tuple:
+        """
+        Запрос списка промокодов компании без LIMIT/OFFSET: запрос данных, запрос для подсчета и ключ сортировки.
+        Keyset-условие и сортировка накладываются на сам запрос, чтобы страница читалась по индексу
+        """
+        # Список компании показывает коды UNIQUE промокодов, поэтому promo_unique загружается
+        query = select(Promo).options(undefer(Promo.promo_unique)).where(Promo.company_id == company_id)
 
-        # Выполнение запроса
-        result = await db.execute(query)
-        promo = result.scalar()
+        # Фильтрация по странам: промокоды без ограничения по стране подходят под любой фильтр
+        if country_param := params.get("country"):
+            countries = [c.strip().lower() for c in country_param.split(",")]
+            query = query.filter(
+                or_(
+                    Promo.target_country.in_(countries),
+                    Promo.target_country.is_(None),
+                )
+            )
+        filter_query = query.with_only_columns(Promo.id)
+
+        # Сортировка по убыванию, пустые даты первыми; при равных значениях - по id
+        sort_by = self._business_sort_by(params)
+        sort_field = getattr(Promo, sort_by)
+        sort_key = [sort_field, Promo.id]
+        query = query.add_columns(*sort_key)
+
+        # Keyset-пагинация: записи строго после последней записи предыдущей страницы
+        if cursor := params.get("cursor"):
+            cursor_sort_by, value, promo_id = decode_cursor(cursor, 3)
+            if cursor_sort_by != sort_by:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor.")
+            value = parse_cursor_datetime(value)
+            promo_id = parse_cursor_uuid(promo_id)
+            if value is None:
+                # Внутри группы пустых дат по id, затем все записи с заполненной датой
+                query = query.filter(
+                    or_(and_(sort_field.is_(None), Promo.id < promo_id), sort_field.is_not(None))
+                )
+            else:
+                query = query.filter(sort_field.is_not(None), tuple_(sort_field, Promo.id) < tuple_(value, promo_id))
+
+        query = query.order_by(sort_field.desc().nulls_first(), Promo.id.desc())
+        return query, filter_query, sort_key
+
+    @staticmethod
+    async def _stream_page(
+            query,
+            filter_query,
+            sort_key: list,
+            offset: int,
+            limit: int,
+            cursor: str | None,
+            convert: Callable[[Promo], dict],
+            prefix: list = (),
+            options: list = (),
+            enrich: Callable[[list[dict], AsyncSession], Awaitable[list[dict]]] | None = None,
+            chunk_size: int = 100,
+    ) -> AsyncIterator:
+        """
+        Потоковое чтение страницы одним запросом через серверный курсор.
+        Первым элементом итератор отдает общее количество и курсор следующей страницы: они нужны для заголовков
+        до начала тела и приходят в первой строке результата. Затем отдаются объекты страницы,
+        дополненные через enrich пачками по chunk_size.
+        Сессия открывается и закрывается самим итератором: сессия из зависимости закрывается раньше,
+        чем завершается потоковый ответ, а ответ закрывает итератор и при отключении клиента
+        """
+        counted = not cursor and settings.listing.count_mode == "exact"
+
+        # Ключи страницы выбираются по индексу с keyset-условием и LIMIT; окна над ними дают количество строк
+        # страницы (есть ли следующая) и ключ последней записи для курсора
+        columns = [Promo.id, *(column.label(f"sort_{position}") for position, column in enumerate(sort_key))]
+        if counted:
+            columns.append(func.count().over().label("total_count"))
+        page = query.with_only_columns(*columns).offset(offset).limit(limit + 1).subquery()
+        page_key = [page.c[f"sort_{position}"] for position in range(len(sort_key))]
+        order = [column.desc() for column in page_key]
+        statement = (
+            select(
+                Promo,
+                func.count().over(),
+                *(func.nth_value(column, limit).over(order_by=order, rows=(None, None)) for column in page_key),
+                page.c.total_count if counted else literal(None),
+            )
+            .options(*options)
+            .join(page, page.c.id == Promo.id)
+            .order_by(*order)
+        )
 
-        print(promo.company_id, company_id)
+        db = async_session_maker()
+        result = None
+        try:
+            total_count = None
+            if not cursor and not counted:
+                total_count = await count_rows(db, filter_query, estimated=True)
+
+            result = await db.stream(statement)
+            row = await result.fetchone()
+            next_cursor = None
+            if row is not None:
+                total_count = row[-1] if counted else total_count
+                if row[1] > limit:
+                    next_cursor = encode_cursor([*prefix, *row[2:2 + len(sort_key)]])
+            elif counted:
+                # Смещение за концом выборки: строк с количеством нет, оно считается отдельно
+                total_count = await count_rows(db, filter_query) if offset else 0
+            yield total_count, next_cursor
+
+            emitted = 0
+            chunk = []
+            while row is not None and emitted < limit:
+                chunk.append(convert(row[0]))
+                emitted += 1
+                if len(chunk) == chunk_size:
+                    for item in await enrich(chunk, db) if enrich else chunk:
+                        yield item
+                    chunk = []
+                row = await result.fetchone() if emitted < limit else None
+            for item in await enrich(chunk, db) if enrich and chunk else chunk:
+                yield item
+        finally:
+            # Отключение клиента отменяет задачу ответа: закрытие защищено от отмены, чтобы соединение вернулось в пул
+            with anyio.CancelScope(shield=True):
+                if result is not None:
+                    await result.close()
+                await db.close()
+
+    async def promo_get_by_id(self, promo_id: int, db: AsyncSession, redis: Redis, company_id: str) -> tuple[dict, str]:
+        """
+        Получение данных промокода по его ID. Сервер должен проверять принадлежность промокода компании
+        GET /business/promo/{id}
+        Возвращает данные и ETag ответа
+        """
+        promo, counters = await self._promo_with_counters(promo_id, db)
 
         # Проверка наличия промокода и принадлежности компании
         if not promo or str(promo.company_id) != company_id:
@@ -175,43 +326,49 @@ class PromoService:
                 detail="Promo not found or not authorized."
             )
 
-        # Преобразование данных в словарь
-        promo_dict = {
-            "promo_id": str(promo.id),
-            "description": promo.description,
-            "image_url": promo.image_url,
-            "target": promo.target or {},
-            "max_count": promo.max_count,
-            "active_from": promo.active_from.strftime('%Y-%m-%d') if promo.active_from else None,
-            "active_until": promo.active_until.strftime('%Y-%m-%d') if promo.active_until else None,
-            "mode": promo.mode,
-            "promo_common": promo.promo_common,
-            "promo_unique": promo.promo_unique or [],
-            "company_name": promo.company.name if promo.company else None,
-            "like_count": len(promo.likes),
-            "used_count": len(promo.comments),
-            "active": promo.active,
-        }
+        like_count = await self._like_count(promo, counters, db, redis)
+        etag = etag_service.make(promo.updated_at, like_count, counters.activation_count if counters else 0)
+        await etag_service.set(promo.id, "detail", etag, redis, company_id=promo.company_id)
 
-        return promo_dict
+        # Преобразование данных в словарь
+        return self._promo_detail(promo, counters, like_count), etag
 
-    async def promo_update(self, promo_id: int, body: dict, db: AsyncSession, company_id: str) -> dict:
+    async def _promo_with_counters(self, promo_id, db: AsyncSession) -> tuple[Promo | None, PromoCounter | None]:
         """
-        Редактирование компанией данных промокода по его ID
-        PATCH /business/promo/{id}
+        Промокод с компанией и счетчиками одной строкой
         """
-        # Загружаем промокод с предзагрузкой связанных данных
         query = (
-            select(Promo)
-            .options(
-                joinedload(Promo.company),
-                joinedload(Promo.likes),
-                joinedload(Promo.comments),
-            )
+            select(Promo, PromoCounter)
+            .outerjoin(PromoCounter, PromoCounter.promo_id == Promo.id)
+            .options(joinedload(Promo.company), undefer(Promo.promo_unique))
             .where(Promo.id == promo_id)
         )
-        result = await db.execute(query)
-        promo = result.scalar()
+        row = (await db.execute(query)).first()
+        return (row.Promo, row.PromoCounter) if row else (None, None)
+
+    @staticmethod
+    async def _like_count(promo: Promo, counters: PromoCounter | None, db: AsyncSession, redis: Redis) -> int:
+        # С отложенной записью лайков актуальное количество хранится в Redis
+        like_count = await like_service.count(promo.id, db, redis)
+        if like_count is None:
+            like_count = counters.like_count if counters else 0
+        return like_count
+
+    @staticmethod
+    def _promo_detail(promo: Promo, counters: PromoCounter | None, like_count: int) -> dict:
+        return serialization.promo_detail(
+            promo,
+            like_count=like_count,
+            used_count=counters.activation_count if counters else 0,
+        )
+
+    async def promo_update(self, promo_id: int, body: dict, db: AsyncSession, redis: Redis, company_id: str) -> dict:
+        """
+        Редактирование компанией данных промокода по его ID
+        PATCH /business/promo/{id}
+        """
+        # Загружаем промокод вместе с компанией и счетчиками
+        promo, counters = await self._promo_with_counters(promo_id, db)
 
         # Проверка прав доступа
         if not promo:
@@ -230,6 +387,10 @@ class PromoService:
         if errors:
             raise HTTPException(status_code=400, detail=errors)
 
+        # Страна и коды до изменения: страницы сегмента тоже нужно сбросить, выданные коды - не выдавать повторно
+        previous_country = (promo.target or {}).get("country")
+        previous_codes = list(promo.promo_unique or [])
+
         # Обновление данных промокода
         for key, value in body.items():
             if key == "target" and isinstance(value, dict):  # Обновление `target` (JSONB)
@@ -239,43 +400,189 @@ class PromoService:
                     value = datetime.strptime(value, "%Y-%m-%d") if value else None
                 setattr(promo, key, value)
 
-        # Обновляем `updated_at`
-        promo.updated_at = datetime.utcnow()
+        # `updated_at` обновляется базой (onupdate) и возвращается через RETURNING
 
         try:
+            # Свободные коды пула заменяются новым списком
+            refill_codes = "promo_unique" in body and promo.mode == "UNIQUE"
+            if refill_codes:
+                await code_pool_service.refill(promo, promo.promo_unique or [], db)
+
             # Сохранение изменений
             await db.commit()
-            promo_dict = {
-                "promo_id": str(promo.id),
-                "description": promo.description,
-                "image_url": promo.image_url,
-                "target": promo.target or {},
-                "max_count": promo.max_count,
-                "active_from": promo.active_from.strftime("%Y-%m-%d") if promo.active_from else None,
-                "active_until": promo.active_until.strftime("%Y-%m-%d") if promo.active_until else None,
-                "mode": promo.mode,
-                "promo_common": promo.promo_common,
-                "promo_unique": promo.promo_unique or [],
-                "company_name": promo.company.name if promo.company else None,
-                "like_count": len(promo.likes),
-                "used_count": len(promo.comments),
-                "active": promo.active,
-            }
-            return promo_dict
+
+            if refill_codes:
+                await code_pool_service.publish(promo, db, redis, previous_codes)
+
+            # Счетчик вместимости пересчитывается по базе при следующей активации
+            if "max_count" in body:
+                await capacity_service.invalidate(promo.id, redis)
+            promo_index.upsert(promo)
+            await etag_service.invalidate(redis, [promo.id])
+            await feed_cache.invalidate(
+                redis,
+                promo_ids=[promo.id],
+                countries=[previous_country, (promo.target or {}).get("country"), None],
+            )
+
+            like_count = await self._like_count(promo, counters, db, redis)
+            return self._promo_detail(promo, counters, like_count)
         except IntegrityError:
             await db.rollback()
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST, detail="Failed to update promo."
             )
 
+    async def promo_bulk_update(self, body: list, db: AsyncSession, redis: Redis, company_id: str) -> list[dict]:
+        """
+        Пакетное редактирование компанией своих промокодов
+        PATCH /business/promo
+        Тело - список частичных изменений с полем id. Одинаковые изменения применяются одним UPDATE,
+        все изменения выполняются в одной транзакции. Возвращает результат по каждому элементу в порядке запроса
+        """
+        if not isinstance(body, list) or not body:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Request body must be a non-empty list of promo updates.",
+            )
+        if len(body) > BULK_UPDATE_MAX_ITEMS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Batch cannot contain more than {BULK_UPDATE_MAX_ITEMS} updates.",
+            )
+
+        results: list[dict | None] = [None] * len(body)
+        patches: dict[UUID, tuple[int, dict]] = {}
+
+        def fail(index: int, item, status_code: int, detail) -> None:
+            promo_id = item.get("id") if isinstance(item, dict) else None
+            results[index] = {"id": promo_id, "status_code": status_code, "detail": detail}
+
+        # Проверка формы элементов
+        for index, item in enumerate(body):
+            if not isinstance(item, dict):
+                fail(index, item, 400, "Update must be an object.")
+                continue
+            try:
+                promo_id = UUID(str(item.get("id")))
+            except ValueError:
+                fail(index, item, 400, "Invalid promo id.")
+                continue
+            if promo_id in patches:
+                fail(index, item, 400, "Duplicate promo id in batch.")
+                continue
+
+            patch = {key: value for key, value in item.items() if key != "id"}
+            unsupported = sorted(set(patch) - BULK_UPDATE_FIELDS)
+            if not patch or unsupported:
+                detail = [{"field": key, "msg": "Field cannot be changed in bulk update."} for key in unsupported]
+                fail(index, item, 400, detail or "Update cannot be empty.")
+                continue
+            patches[promo_id] = (index, patch)
+
+        # Проверка принадлежности и данных по текущему состоянию промокодов
+        rows = {}
+        if patches:
+            query = select(Promo.id, Promo.company_id, Promo.mode, Promo.target).where(Promo.id.in_(patches))
+            rows = {row.id: row for row in (await db.execute(query)).all()}
+
+        groups: dict[str, tuple[dict, list[UUID]]] = {}
+        for promo_id, (index, patch) in patches.items():
+            row = rows.get(promo_id)
+            if row is None:
+                fail(index, body[index], 404, "Promo not found.")
+            elif str(row.company_id) != company_id:
+                fail(index, body[index], 403, "You are not authorized to edit this promo.")
+            elif errors := self.validate_promo(patch, row):
+                fail(index, body[index], 400, errors)
+            else:
+                # Одинаковые изменения объединяются в один UPDATE
+                key = json.dumps(patch, sort_keys=True, default=str)
+                groups.setdefault(key, (patch, []))[1].append(promo_id)
+
+        updated: list[tuple[Promo, dict]] = []
+        try:
+            for patch, promo_ids in groups.values():
+                statement = (
+                    update(Promo)
+                    .where(Promo.id.in_(promo_ids), Promo.company_id == company_id)
+                    .values(self._bulk_values(patch))
+                    .returning(Promo)
+                )
+                promos = await db.execute(statement, execution_options={"synchronize_session": False})
+                updated.extend((promo, patch) for promo in promos.scalars().all())
+            await db.commit()
+        except (IntegrityError, DataError):
+            await db.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="Failed to update promos."
+            )
+
+        # Сброс производных данных: вместимость, индекс ленты, кеш страниц и ETag
+        countries = {None}
+        for promo, patch in updated:
+            results[patches[promo.id][0]] = {"id": str(promo.id), "status_code": 200}
+            if "max_count" in patch:
+                await capacity_service.invalidate(promo.id, redis)
+            promo_index.upsert(promo)
+            countries.add((rows[promo.id].target or {}).get("country"))
+            countries.add((promo.target or {}).get("country"))
+
+        # Промокоды, удаленные между проверкой и изменением
+        for index, result in enumerate(results):
+            if result is None:
+                fail(index, body[index], 404, "Promo not found.")
+
+        updated_ids = [promo.id for promo, _ in updated]
+        await etag_service.invalidate(redis, updated_ids)
+        await feed_cache.invalidate(redis, promo_ids=updated_ids, countries=countries)
+
+        return results
+
+    @staticmethod
+    def _bulk_values(patch: dict) -> dict:
+        """
+        Значения UPDATE для частичного изменения. target объединяется с текущим значением (пустой объект очищает его)
+        """
+        values = {}
+        for key, value in patch.items():
+            if key == "target":
+                value = func.coalesce(Promo.target, literal({}, JSONB)).op("||")(literal(value, JSONB)) if value else {}
+            elif key in ["active_from", "active_until"]:
+                value = datetime.strptime(value, "%Y-%m-%d") if value else None
+            values[key] = value
+        return values
+
+    @staticmethod
+    def _invalid_types(body: dict) -> list[dict]:
+        """
+        Проверка типов полей: значение неверного типа дает ошибку поля, а не исключение при проверке значения
+        или при записи в базу. bool не принимается там, где ожидается число
+        """
+        errors = []
+        for field, (types, msg) in FIELD_TYPES.items():
+            if field not in body:
+                continue
+            value = body[field]
+            if not isinstance(value, types) or (isinstance(value, bool) and bool not in types):
+                errors.append({"field": field, "msg": msg})
+            elif field == "promo_unique" and value is not None and not all(isinstance(code, str) for code in value):
+                errors.append({"field": field, "msg": msg})
+        return errors
+
     def validate_promo(self, body: dict, promo: Optional[Promo] = None) -> dict:
         # Валидация входящих данных
-        errors = []
+        errors = self._invalid_types(body)
+        invalid = {error["field"] for error in errors}
+
+        def check(field: str) -> bool:
+            # Значение проверяется, только если поле передано и имеет допустимый тип
+            return field in body and field not in invalid
 
-        if "description" in body and len(body["description"]) < 10:
+        if check("description") and len(body["description"]) < 10:
             errors.append({"field": "description", "msg": "Description must be at least 10 characters long."})
 
-        if "mode" in body:
+        if check("mode"):
             if body["mode"] not in {"COMMON", "UNIQUE"}:
                 errors.append({"field": "mode", "msg": "Invalid mode. Allowed values are 'COMMON' or 'UNIQUE'."})
 
@@ -291,111 +598,312 @@ class PromoService:
             elif not body["image_url"].startswith(("http://", "https://")):
                 errors.append({"field": "image_url", "msg": "Image URL must start with 'http://' or 'https://'."})
 
-        if "target" in body:
-            target = body["target"]
-            age_from = target.get("age_from")
-            age_until = target.get("age_until")
-            if age_from is not None and age_until is not None and age_from > age_until:
-                errors.append({"field": "target", "msg": "'age_from' cannot be greater than 'age_until'."})
-            categories = target.get("categories", [])
-            if any(not category for category in categories):
-                errors.append({"field": "target.categories", "msg": "Categories cannot contain empty values."})
-            country = target.get("country")
-            if country is not None and not pycountry.countries.get(alpha_2=country.upper()):
-                errors.append({"field": "target.country", "msg": "Country must be a valid ISO 3166-1 alpha-2 code."})
-
+        if check("target"):
+            errors.extend(self._target_errors(body["target"]))
 
-        if "max_count" in body and promo is not None and promo.mode == "UNIQUE" and body["max_count"] != 1:
-            errors.append({"field": "max_count", "msg": "For UNIQUE mode, max_count must be 1."})
+        if check("max_count"):
+            if not 0 <= body["max_count"] <= MAX_COUNT_LIMIT:
+                errors.append({"field": "max_count", "msg": f"Max_count must be between 0 and {MAX_COUNT_LIMIT}."})
+            elif promo is not None and promo.mode == "UNIQUE" and body["max_count"] != 1:
+                errors.append({"field": "max_count", "msg": "For UNIQUE mode, max_count must be 1."})
 
-        if "active_from" in body:
+        # null очищает дату
+        if check("active_from") and body["active_from"] is not None:
             try:
                 datetime.strptime(body["active_from"], "%Y-%m-%d")
             except ValueError:
                 errors.append({"field": "active_from", "msg": "Active_from must be in 'YYYY-MM-DD' format."})
 
-        if "active_until" in body:
+        if check("active_until") and body["active_until"]:
             try:
-                if body["active_until"]:
-                    datetime.strptime(body["active_until"], "%Y-%m-%d")
+                datetime.strptime(body["active_until"], "%Y-%m-%d")
             except ValueError:
                 errors.append({"field": "active_until", "msg": "Active_until must be in 'YYYY-MM-DD' format."})
 
         return errors
 
-    async def promo_user_get_list(self, db: AsyncSession, user_id: str, country: str = None, search: str = None) -> dict:
+    @staticmethod
+    def _target_errors(target: dict) -> list[dict]:
+        """
+        Проверка условий таргетинга
+        """
+        errors = []
+        age_from = target.get("age_from")
+        age_until = target.get("age_until")
+        for field, age in (("age_from", age_from), ("age_until", age_until)):
+            if age is not None and (not isinstance(age, int) or isinstance(age, bool)):
+                errors.append({"field": f"target.{field}", "msg": "Age must be an integer."})
+        if not errors and age_from is not None and age_until is not None and age_from > age_until:
+            errors.append({"field": "target", "msg": "'age_from' cannot be greater than 'age_until'."})
+
+        categories = target.get("categories") or []
+        if not isinstance(categories, list) or not all(isinstance(category, str) for category in categories):
+            errors.append({"field": "target.categories", "msg": "Categories must be a list of strings."})
+        elif any(not category for category in categories):
+            errors.append({"field": "target.categories", "msg": "Categories cannot contain empty values."})
+
+        country = target.get("country")
+        if country is not None and (not isinstance(country, str) or not pycountry.countries.get(alpha_2=country.upper())):
+            errors.append({"field": "target.country", "msg": "Country must be a valid ISO 3166-1 alpha-2 code."})
+        return errors
+
+    async def promo_user_get_list(
+            self,
+            db: AsyncSession,
+            user_id: str,
+            country: str = None,
+            search: str = None,
+            limit: int = 10,
+            cursor: str = None,
+    ) -> dict:
         """
         Получение пользователем ленты промокодов
         GET /user/feed
+        Лента упорядочена по (created_at, id) по убыванию и листается курсором
         """
-        # Определяем текущую дату в UTC+3 и делаем её наивной
-        current_time = (datetime.now(timezone.utc) + timedelta(hours=3)).replace(tzinfo=None)
+        # Без поиска лента отдается из индекса активных промокодов в памяти воркера
+        if promo_index.ready and not search:
+            return self._feed_from_index(country, limit, cursor)
+
+        query, filter_query, sort_key = self._feed_query(country, search, cursor)
+
+        # Выполнение запроса: страница и общее количество одним запросом
+        rows, total_count = await self._fetch_page(db, query, filter_query, 0, limit, cursor)
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(list(rows[-1][1:len(sort_key) + 1]))
+
+        return {
+            "total_count": total_count,
+            "promos": [serialization.promo_card(row[0]) for row in rows],
+            "next_cursor": next_cursor,
+        }
 
-        # Подзапрос для подсчета количества активаций (если требуется)
-        common_count_subquery = (
-            select(func.count()).where(Promo.mode == "COMMON").label("common_count")
+    async def promo_user_get_feed_stream(
+            self,
+            redis: Redis,
+            user_id: str,
+            country: str = None,
+            search: str = None,
+            limit: int = 10,
+            cursor: str = None,
+    ) -> tuple[int | None, str | None, AsyncIterator[dict]]:
+        """
+        Потоковое получение ленты промокодов
+        GET /user/feed с Accept: application/x-ndjson или application/json; stream=true
+        Возвращает общее количество, курсор следующей страницы и итератор карточек
+        """
+        if promo_index.ready and not search:
+            result = self._feed_from_index(country, limit, cursor)
+            return result["total_count"], result["next_cursor"], self._enrich_cards(result["promos"], user_id, redis)
+
+        query, filter_query, sort_key = self._feed_query(country, search, cursor)
+        items = self._stream_page(
+            query, filter_query, sort_key,
+            offset=0,
+            limit=limit,
+            cursor=cursor,
+            convert=serialization.promo_card,
+            enrich=lambda cards, db: engagement_service.enrich(cards, user_id, db, redis),
         )
+        total_count, next_cursor = await anext(items)
+        return total_count, next_cursor, items
+
+    @staticmethod
+    async def _enrich_cards(cards: list[dict], user_id: str, redis: Redis) -> AsyncIterator[dict]:
+        """
+        Дополнение карточек из индекса социальными данными в собственной сессии итератора
+        """
+        async with async_session_maker() as db:
+            for card in await engagement_service.enrich(cards, user_id, db, redis):
+                yield card
+
+    @staticmethod
+    def _feed_from_index(country: str | None, limit: int, cursor: str | None) -> dict:
+        after = None
+        if cursor:
+            created_at, promo_id = decode_cursor(cursor, 2)
+            after = (parse_cursor_datetime(created_at), str(parse_cursor_uuid(promo_id)))
+        promos_dicts, total_count, next_key = promo_index.page(country, limit, after)
+        return {
+            "total_count": total_count,
+            "promos": promos_dicts,
+            "next_cursor": encode_cursor(list(next_key)) if next_key else None,
+        }
+
+    def _feed_query(self, country: str | None, search: str | None, cursor: str | None) -> tuple:
+        """
+        Запрос ленты без LIMIT: запрос данных, запрос для подсчета и ключ сортировки
+        """
+        # Определяем текущую дату в UTC+3 и делаем её наивной
+        now = current_time()
+
+        # Количество активаций берется из поддерживаемых счетчиков, а не считается по promo_activations
+        activation_count = func.coalesce(PromoCounter.activation_count, 0)
 
         # Базовый запрос для активных промокодов
-        query = select(Promo).where(
+        query = select(Promo).outerjoin(PromoCounter, PromoCounter.promo_id == Promo.id).where(
             and_(
                 Promo.active == True,
-                Promo.active_from <= current_time,
-                or_(Promo.active_until.is_(None), Promo.active_until >= current_time),
+                Promo.active_from <= now,
+                or_(Promo.active_until.is_(None), Promo.active_until >= now),
                 or_(
-                    and_(Promo.mode == "COMMON", Promo.max_count > common_count_subquery),
-                    and_(Promo.mode == "UNIQUE", Promo.promo_unique.is_not(None))
+                    and_(Promo.mode == "COMMON", Promo.max_count > activation_count),
+                    and_(Promo.mode == "UNIQUE", Promo.code_count > activation_count),
                 )
             )
         )
 
-        # Подсчет общего количества записей
-        total_query = select(func.count()).select_from(query.subquery())
-        total_count = (await db.execute(total_query)).scalar()
-
         # Фильтрация по стране
         if country:
-            query = query.filter(Promo.target["country"].astext.ilike(f"%{country}%"))
+            query = query.filter(self._country_filter(country))
 
-        # Поиск по строке search (регистронезависимый)
+        # Поиск по строке search: полнотекстовый по словам и триграммный по подстроке, с ранжированием
         if search:
-            search_pattern = f"%{search.lower()}%"
-            query = query.filter(
-                or_(
-                    func.lower(Promo.description).ilike(search_pattern),
-                    func.lower(Promo.promo_common).ilike(search_pattern)
-                )
-            )
-
-        # Выполнение запроса
-        promos = (await db.execute(query)).scalars().all()
-
-        promos_dicts = [
-            {
-                "id": promo.id,
-                "description": promo.description,
-                "image_url": promo.image_url,
-                "target": promo.target,
-                "max_count": promo.max_count,
-                "active_from": promo.active_from,
-                "active_until": promo.active_until,
-                "mode": promo.mode,
-                "created_at": promo.created_at,
-                "active": promo.active,
-            }
-            for promo in promos
-        ]
+            query, rank = self._apply_search(query, search)
+        filter_query = query.with_only_columns(Promo.id)
+
+        sort_key = ([rank] if search else []) + [Promo.created_at, Promo.id]
+        query = query.add_columns(*sort_key)
+
+        # Keyset-пагинация: записи строго после последней записи предыдущей страницы
+        if cursor:
+            values = decode_cursor(cursor, len(sort_key))
+            if search and not isinstance(values[0], (int, float)):
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor.")
+            values[-2] = parse_cursor_datetime(values[-2])
+            values[-1] = parse_cursor_uuid(values[-1])
+            query = query.filter(tuple_(*sort_key) < tuple_(*values))
+        query = query.order_by(*(column.desc() for column in sort_key))
+        return query, filter_query, sort_key
+
+
+    async def promo_user_get_feed(
+            self,
+            db: AsyncSession,
+            redis: Redis,
+            user_id: str,
+            country: str = None,
+            search: str = None,
+            limit: int = 10,
+            cursor: str = None,
+    ) -> FeedPage:
+        """
+        Сериализованная страница ленты с кешированием в Redis
+        GET /user/feed
+        В кеше хранится общая для всех пользователей страница; социальные данные карточек
+        добавляются к ней при каждом запросе
+        """
+        page = await self._feed_page(db, redis, country, search, limit, cursor)
+        cards = await engagement_service.enrich(serialization.loads(page.body), user_id, db, redis)
+        return page._replace(body=feed_cache.render(cards))
+
+    async def _feed_page(
+            self,
+            db: AsyncSession,
+            redis: Redis,
+            country: str | None,
+            search: str | None,
+            limit: int,
+            cursor: str | None,
+    ) -> FeedPage:
+        """
+        Страница ленты без данных пользователя: из кеша или из базы с сохранением в кеш
+        """
+        if not feed_cache.enabled:
+            result = await self.promo_user_get_list(db, None, country, search, limit, cursor)
+            return FeedPage(feed_cache.render(result["promos"]), result["total_count"], result["next_cursor"])
+
+        key = feed_cache.key(country, search, limit, cursor)
+        page = await feed_cache.get(key, redis)
+        if page is not None:
+            return page
+
+        generation = await feed_cache.generation(redis)
+        result = await self.promo_user_get_list(db, None, country, search, limit, cursor)
+        page = FeedPage(feed_cache.render(result["promos"]), result["total_count"], result["next_cursor"])
+        ttl = await self._feed_ttl(result["promos"], country, db)
+        await feed_cache.set(key, page, generation, ttl, country, [promo["id"] for promo in result["promos"]], redis)
+        return page
+
+    async def _feed_ttl(self, promos: list[dict], country: str | None, db: AsyncSession) -> int:
+        """
+        Время жизни страницы ленты: не дольше ближайшего окончания активности промокода на странице
+        и ближайшего открытия промокода в сегменте
+        """
+        now = current_time()
+        deadlines = [promo["active_until"] for promo in promos if promo["active_until"] is not None]
 
-        return {
-            "total_count": total_count,
-            "promos": promos_dicts,
-        }
+        # Ближайшее открытие читается с начала частичного индекса по active_from активных промокодов
+        query = select(func.min(Promo.active_from)).where(Promo.active == True, Promo.active_from > now)
+        if country:
+            query = query.filter(self._country_filter(country))
+        next_opening = (await db.execute(query)).scalar()
+        if next_opening is not None:
+            deadlines.append(next_opening)
+
+        ttl = feed_cache.ttl
+        for deadline in deadlines:
+            # Промокод скрывается сразу после active_until, поэтому срок округляется вверх
+            ttl = min(ttl, int((deadline - now).total_seconds()) + 1)
+        return max(ttl, 1)
+
+    @staticmethod
+    async def _fetch_page(db: AsyncSession, query, filter_query, offset: int, limit: int, cursor: str | None) -> tuple[list, int | None]:
+        """
+        Строки страницы (limit + 1, чтобы определить наличие следующей) и общее количество.
+        Количество приходит в той же строке через count(*) OVER (): окно считается по отфильтрованной
+        выборке до OFFSET/LIMIT. На страницах по курсору количество не считается (None): клиент уже получил
+        его с первой страницы, а keyset-страница не должна читать всю выборку.
+        В режиме estimated количество - оценка планировщика отдельным EXPLAIN
+        """
+        counted = not cursor and settings.listing.count_mode == "exact"
+        if counted:
+            query = query.add_columns(func.count().over())
+        rows = (await db.execute(query.offset(offset).limit(limit + 1))).all()
+
+        if cursor:
+            return rows, None
+        if not counted:
+            return rows, await count_rows(db, filter_query, estimated=True)
+        if rows:
+            return rows, rows[0][-1]
+        # Смещение за концом выборки: строк с количеством нет, оно считается отдельно
+        return rows, await count_rows(db, filter_query) if offset else 0
+
+    @staticmethod
+    def _country_filter(country: str):
+        """
+        Условие фильтрации промокодов по стране таргетинга
+        """
+        return Promo.target_country == country.lower()
 
+    @staticmethod
+    def _apply_search(query, search: str):
+        """
+        Фильтр поиска по описанию и коду промокода.
+        Слова ищутся по tsvector (GIN-индекс), подстроки - через ILIKE по триграммным индексам.
+        Возвращает запрос и выражение релевантности
+        """
+        ts_query = func.websearch_to_tsquery("simple", search)
+        pattern = "%" + search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        rank = func.ts_rank_cd(Promo.search_vector, ts_query)
+        query = query.filter(
+            or_(
+                Promo.search_vector.op("@@")(ts_query),
+                Promo.description.ilike(pattern, escape="\\"),
+                Promo.promo_common.ilike(pattern, escape="\\"),
+            )
+        )
+        return query, rank
 
-    async def promo_user_get_by_id(self, promo_id: str, db: AsyncSession, user_id: str) -> dict:
+    async def promo_user_get_by_id(self, promo_id: str, db: AsyncSession, redis: Redis, user_id: str) -> tuple[dict, str]:
         """
         Получение пользователем информации по промокоду по его id (без активации)
         GET /user/promo/{id}
+        Возвращает карточку и ETag ответа
         """
         promo = await db.get(Promo, promo_id)
 
@@ -405,91 +913,90 @@ class PromoService:
                 detail="Promo not found or inactive."
             )
 
-        return {
-                "id": promo.id,
-                "description": promo.description,
-                "image_url": promo.image_url,
-                "target": promo.target,
-                "max_count": promo.max_count,
-                "active_from": promo.active_from,
-                "active_until": promo.active_until,
-                "mode": promo.mode,
-                "created_at": promo.created_at,
-                "active": promo.active,
-            }
+        # Карточку обычно открывают перед активацией, поэтому вердикт антифрода запрашивается заранее
+        if antifraud_service.prefetch_enabled:
+            profile = await user_service.profile_snapshot(user_id, db, redis)
+            antifraud_service.prefetch(profile.email, promo_id, redis)
+
+        card = serialization.promo_card(promo)
+        await engagement_service.enrich([card], user_id, db, redis)
+
+        # Карточка содержит данные пользователя, поэтому ETag хранится для каждого пользователя отдельно
+        etag = etag_service.make(
+            promo.updated_at,
+            card["like_count"],
+            card["comment_count"],
+            card["is_liked_by_user"],
+            card["is_activated_by_user"],
+        )
+        await etag_service.set(promo.id, f"card:{user_id}", etag, redis, company_id=promo.company_id)
+        return card, etag
 
 
-    async def promo_like_create(self, promo_id: str, user_id: str, db: AsyncSession) -> dict:
+    async def promo_like_create(self, promo_id: str, user_id: str, db: AsyncSession, redis: Redis) -> dict:
         """
         Создание пользователем своего лайка промокоду
         POST /user/promo/{id}/like
         """
-        # Проверяем, существует ли промокод
-        promo = await db.execute(select(Promo).where(Promo.id == promo_id))
-        if not promo.scalars().first():
-            raise HTTPException(status_code=404, detail="Promo not found.")
-
-        # Проверяем, есть ли уже лайк от пользователя
-        like_exists = await db.execute(
-            select(Like).where(Like.promo_id == promo_id, Like.user_id == user_id)
-        )
-        if like_exists.scalars().first():
+        if not await like_service.set_like(promo_id, user_id, True, db, redis):
             return {"detail": "Like already exists."}
-
-        # Создаём лайк
-        like = Like(
-            id=str(uuid4()),
-            promo_id=promo_id,
-            user_id=user_id,
-            created_at=datetime.utcnow()
-        )
-        db.add(like)
-        await db.commit()
+        await etag_service.invalidate(redis, [promo_id])
         return {"detail": "Like created successfully."}
 
-
-    async def promo_like_delete(self, promo_id: str, user_id: str, db: AsyncSession) -> dict:
+    async def promo_like_delete(self, promo_id: str, user_id: str, db: AsyncSession, redis: Redis) -> dict:
         """
         Удаление пользователем своего лайка с промокода
         DELETE /user/promo/{id}/like
         """
-        # Проверяем, существует ли промокод
-        promo = await db.execute(select(Promo).where(Promo.id == promo_id))
-        if not promo.scalars().first():
-            raise HTTPException(status_code=404, detail="Promo not found.")
-
-        # Проверяем, есть ли лайк от пользователя
-        like = await db.execute(
-            select(Like).where(Like.promo_id == promo_id, Like.user_id == user_id)
-        )
-        like = like.scalars().first()
-        if not like:
+        if not await like_service.set_like(promo_id, user_id, False, db, redis):
             return {"detail": "Like does not exist."}
-
-        # Удаляем лайк
-        await db.delete(like)
-        await db.commit()
+        await etag_service.invalidate(redis, [promo_id])
         return {"detail": "Like deleted successfully."}
 
-
-    async def promo_comment_get_all(self, promo_id: str, db: AsyncSession) -> dict:
+    async def promo_comment_get_all(
+            self,
+            promo_id: str,
+            db: AsyncSession,
+            redis: Redis,
+            limit: int = 10,
+            cursor: str | None = None,
+    ) -> tuple[list, str | None, str]:
         """
         Получение пользователем списка комментариев к промокоду
         GET /user/promo/{id}/comments
+        Комментарии упорядочены по (created_at, id) по убыванию, листаются курсором и содержат имя автора.
+        Возвращает комментарии, курсор следующей страницы и ETag ответа
         """
-        comments = await db.execute(
-            select(Comment).where(Comment.promo_id == promo_id).order_by(Comment.created_at.desc())
+        query = (
+            select(Comment, User.name, User.surname)
+            .join(User, User.id == Comment.user_id)
+            .where(Comment.promo_id == promo_id)
+            .order_by(Comment.created_at.desc(), Comment.id.desc())
         )
-        return [
-            {
-                "id": comment.id,
-                "content": comment.content,
-                "created_at": comment.created_at,
-                "updated_at": comment.updated_at,
-                "user_id": comment.user_id,
-            }
-            for comment in comments.scalars().all()
+        if cursor:
+            created_at, comment_id = decode_cursor(cursor, 2)
+            query = query.filter(
+                tuple_(Comment.created_at, Comment.id) < tuple_(parse_cursor_datetime(created_at), parse_cursor_uuid(comment_id))
+            )
+
+        rows = (await db.execute(query.limit(limit + 1))).all()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor([rows[-1].Comment.created_at, rows[-1].Comment.id])
+
+        # Добавление, удаление и редактирование комментария меняют ETag страницы
+        etag = etag_service.make(
+            next_cursor,
+            *[(row.Comment.id, row.Comment.updated_at, row.name, row.surname) for row in rows],
+        )
+        await etag_service.set(promo_id, f"comments:{limit}:{cursor or ''}", etag, redis)
+
+        comments = [
+            serialization.comment(row.Comment, author={"name": row.name, "surname": row.surname})
+            for row in rows
         ]
+        return comments, next_cursor, etag
 
     async def promo_comment_get_by_id(self, promo_id: str, comment_id: str, db: AsyncSession) -> dict:
         """
@@ -502,15 +1009,9 @@ class PromoService:
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Comment not found."
             )
-        return {
-            "id": comment.id,
-            "content": comment.content,
-            "created_at": comment.created_at,
-            "updated_at": comment.updated_at,
-            "user_id": comment.user_id,
-        }
+        return serialization.comment(comment)
 
-    async def promo_comment_create(self, promo_id: str, user_id: str, body: dict, db: AsyncSession) -> dict:
+    async def promo_comment_create(self, promo_id: str, user_id: str, body: dict, db: AsyncSession, redis: Redis) -> dict:
         """
         Создание пользователем комментария к промокоду
         POST /user/promo/{id}/comments
@@ -530,10 +1031,12 @@ class PromoService:
             created_at=datetime.utcnow()
         )
         db.add(comment)
+        await counter_service.increment(db, promo_id, comment_count=1)
         await db.commit()
+        await etag_service.invalidate(redis, [promo_id])
         return {"id": comment.id, "detail": "Comment created successfully."}
 
-    async def promo_comment_update(self, promo_id: str, comment_id: str, user_id: str, body: dict, db: AsyncSession) -> dict:
+    async def promo_comment_update(self, promo_id: str, comment_id: str, user_id: str, body: dict, db: AsyncSession, redis: Redis) -> dict:
         """
         Редактирование пользователем комментария к промокоду
         PUT /user/promo/{id}/comments/{comment_id}
@@ -555,9 +1058,10 @@ class PromoService:
         comment.content = content
         comment.updated_at = datetime.utcnow()
         await db.commit()
+        await etag_service.invalidate(redis, [promo_id])
         return {"id": comment.id, "detail": "Comment updated successfully."}
 
-    async def promo_comment_delete(self, promo_id: str, comment_id: str, user_id: str, db: AsyncSession) -> dict:
+    async def promo_comment_delete(self, promo_id: str, comment_id: str, user_id: str, db: AsyncSession, redis: Redis) -> dict:
         """
         Удаление пользователем комментария к промокоду
         DELETE /user/promo/{id}/comments/{comment_id}
@@ -570,7 +1074,9 @@ class PromoService:
             )
 
         await db.delete(comment)
+        await counter_service.increment(db, promo_id, comment_count=-1)
         await db.commit()
+        await etag_service.invalidate(redis, [promo_id])
         return {"detail": "Comment deleted successfully."}
 
     async def promo_activate(self, promo_id: str, db: AsyncSession, redis: Redis,  user_id: str) -> dict:
@@ -578,8 +1084,12 @@ class PromoService:
         Активация промокода пользователем
         POST user/promo/{id}/activate
         """
-        # Проверяем существование промокода
-        promo = await db.get(Promo, promo_id)
+        # Проверяем существование промокода; читаются только колонки, нужные для активации
+        promo = (await db.execute(
+            select(Promo)
+            .options(load_only(Promo.id, Promo.active, Promo.mode, Promo.target, Promo.max_count, Promo.updated_at))
+            .where(Promo.id == promo_id)
+        )).scalar()
         if not promo or not promo.active:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
@@ -587,14 +1097,15 @@ class PromoService:
             )
 
         # Проверяем соответствие таргетингу промокода
-        if promo.target and not user_service.matches_targeting(user_id, promo.target, db):
+        profile = await user_service.profile_snapshot(user_id, db, redis)
+        if not targeting_service.compile(promo).matches(profile):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="User does not match promo targeting criteria."
             )
 
         # Запрашиваем антифрод-вердикт
-        antifraud_result = await antifraud_service.check_user(user_id, promo_id, redis)
+        antifraud_result = await antifraud_service.check_user(profile.email, promo_id, redis)
         if not antifraud_result:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
@@ -602,32 +1113,29 @@ class PromoService:
             )
 
         # Активация для COMMON промокодов
+        reserved = False
+        remaining = None
+        activation_value = None
         if promo.mode == "COMMON":
-            if promo.max_count <= (await db.execute(
-                select(func.count()).where(PromoActivation.promo_id == promo_id)
-            )).scalar():
+            remaining = await capacity_service.reserve(promo, db, redis)
+            if remaining is None:
                 raise HTTPException(
                     status_code=status.HTTP_403_FORBIDDEN,
                     detail="Promo code activation limit reached."
                 )
-
-            activation = PromoActivation(
-                id=str(uuid4()),
-                promo_id=promo.id,
-                user_id=user_id,
-                activated_at=datetime.utcnow(),
-            )
-            db.add(activation)
+            reserved = True
 
         # Активация для UNIQUE промокодов
         elif promo.mode == "UNIQUE":
-            if not promo.promo_unique:
+            activation_value = await code_pool_service.claim(promo, user_id, db, redis)
+            if activation_value is None:
                 raise HTTPException(
                     status_code=status.HTTP_403_FORBIDDEN,
                     detail="No unique values available for activation."
                 )
 
-            activation_value = promo.promo_unique.pop()
+        # В режиме write-behind запись активации откладывается и выполняется пакетно
+        if not activation_writer.enabled:
             activation = PromoActivation(
                 id=str(uuid4()),
                 promo_id=promo.id,
@@ -636,30 +1144,42 @@ class PromoService:
                 activated_at=datetime.utcnow(),
             )
             db.add(activation)
-            promo.promo_unique = promo.promo_unique
 
-        # Сохраняем изменения
-        await db.commit()
+        # Сохраняем изменения, при ошибке возвращаем зарезервированное место или код
+        try:
+            if not activation_writer.enabled:
+                await counter_service.increment(db, promo.id, activation_count=1)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            if reserved:
+                await capacity_service.release(promo.id, redis)
+            if activation_value is not None:
+                await code_pool_service.release(promo.id, activation_value, redis)
+            raise
+
+        if activation_writer.enabled:
+            await activation_writer.submit(promo.id, user_id, activation_value)
+        else:
+            await etag_service.invalidate(redis, [promo.id])
+        promo_index.record_activation(promo.id)
+        # Исчерпанный промокод пропадает из ленты; UNIQUE промокоды уходят из кеша по истечении TTL
+        if remaining == 0:
+            await feed_cache.invalidate(redis, promo_ids=[promo.id])
         return {"detail": "Promo activated successfully."}
 
     async def promo_history(self, user_id: str, db: AsyncSession) -> dict:
         """
         Получение пользователем исторической сводки по активированным промокодам
         GET /user/promo/history
+        В режиме write-behind активации появляются в истории после записи пакета
         """
         activations = await db.execute(
             select(PromoActivation)
             .where(PromoActivation.user_id == user_id)
             .order_by(PromoActivation.activated_at.desc())
         )
-        return [
-            {
-                "promo_id": activation.promo_id,
-                "activation_value": activation.activation_value,
-                "activated_at": activation.activated_at,
-            }
-            for activation in activations.scalars().all()
-        ]
+        return [serialization.history_entry(activation) for activation in activations.scalars().all()]
 
     async def promo_stat(self, promo_id: str, company_id: str, db: AsyncSession) -> dict:
         """
@@ -0,0 +1,290 @@
+import asyncio
+import heapq
+import logging
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta, timezone
+from typing import Hashable, NamedTuple
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.future import select
+from sqlalchemy.sql import func
+
+from src.core.config import settings
+from src.core.serialization import promo_card
+from src.models.promo import Promo, PromoActivation
+
+logger = logging.getLogger(__name__)
+
+
+def current_time() -> datetime:
+    """
+    Текущее время в UTC+3 без часового пояса, в котором сравниваются даты активности промокодов
+    """
+    return (datetime.now(timezone.utc) + timedelta(hours=3)).replace(tzinfo=None)
+
+
+def promo_capacity(promo: Promo) -> int:
+    """
+    Максимальное количество активаций промокода
+    """
+    if promo.mode == "UNIQUE":
+        return promo.code_count or 0
+    return promo.max_count
+
+
+class IndexedPromo(NamedTuple):
+    """
+    Запись индекса: поля для фильтрации и готовая карточка ленты
+    """
+    id: str
+    sort_key: tuple[datetime, str]
+    country: str | None
+    active_from: datetime | None
+    active_until: datetime | None
+    capacity: int
+    card: dict
+
+
+class TimerWheel:
+    """
+    Колесо таймеров: события группируются в слоты по resolution секунд
+    и срабатывают все сразу при прохождении слота
+    """
+
+    def __init__(self, resolution: float):
+        self.resolution = resolution
+        self._slots: dict[int, set[Hashable]] = {}
+        self._heap: list[int] = []
+
+    def _slot(self, at: datetime) -> int:
+        return int(at.timestamp() // self.resolution)
+
+    def schedule(self, key: Hashable, at: datetime) -> None:
+        slot = self._slot(at)
+        if slot not in self._slots:
+            self._slots[slot] = set()
+            heapq.heappush(self._heap, slot)
+        self._slots[slot].add(key)
+
+    def advance(self, now: datetime) -> set[Hashable]:
+        """
+        Возвращает ключи всех событий, наступивших к моменту now
+        """
+        current = self._slot(now)
+        due = set()
+        while self._heap and self._heap[0] < current:
+            due |= self._slots.pop(heapq.heappop(self._heap))
+        return due
+
+
+class ActivePromoIndex:
+    """
+    Индекс активных промокодов в памяти воркера.
+    Записи упорядочены по (created_at, id) и разбиты по странам таргетинга.
+    Индекс обновляется событиями создания/изменения промокодов в этом воркере и периодическим
+    опросом изменений в базе; открытие и окончание периода активности обрабатываются колесом таймеров
+    """
+
+    def __init__(self):
+        self.enabled = settings.feed_index.enabled
+        self.poll_interval = settings.feed_index.poll_interval
+        self.overlap = timedelta(seconds=settings.feed_index.poll_overlap)
+        self.ready = False
+        self._entries: dict[str, IndexedPromo] = {}
+        self._usage: dict[str, int] = {}
+        self._visible: list[tuple[datetime, str]] = []
+        self._by_country: dict[str, list[tuple[datetime, str]]] = {}
+        self._shown: set[str] = set()
+        self._wheel = TimerWheel(settings.feed_index.timer_resolution)
+        self._updated_watermark: datetime | None = None
+        self._activated_watermark: datetime | None = None
+
+    def _is_visible(self, entry: IndexedPromo, now: datetime) -> bool:
+        # Как и в SQL-запросе ленты, промокод без active_from в ленту не попадает
+        if entry.active_from is None or entry.active_from > now:
+            return False
+        if entry.active_until is not None and entry.active_until < now:
+            return False
+        return self._usage.get(entry.id, 0) < entry.capacity
+
+    def _hide(self, promo_id: str) -> None:
+        if promo_id not in self._shown:
+            return
+        entry = self._entries[promo_id]
+        self._shown.discard(promo_id)
+        self._remove_key(self._visible, entry.sort_key)
+        if entry.country is not None:
+            self._remove_key(self._by_country[entry.country], entry.sort_key)
+
+    def _show(self, promo_id: str) -> None:
+        if promo_id in self._shown:
+            return
+        entry = self._entries[promo_id]
+        self._shown.add(promo_id)
+        insort(self._visible, entry.sort_key)
+        if entry.country is not None:
+            insort(self._by_country.setdefault(entry.country, []), entry.sort_key)
+
+    @staticmethod
+    def _remove_key(keys: list, key: tuple) -> None:
+        position = bisect_left(keys, key)
+        if position < len(keys) and keys[position] == key:
+            del keys[position]
+
+    def _refresh(self, promo_id: str, now: datetime) -> None:
+        """
+        Пересчет видимости промокода в ленте
+        """
+        entry = self._entries.get(promo_id)
+        if entry is None:
+            return
+        if entry.active_until is not None and entry.active_until < now:
+            self._hide(promo_id)
+            del self._entries[promo_id]
+            self._usage.pop(promo_id, None)
+        elif self._is_visible(entry, now):
+            self._show(promo_id)
+        else:
+            self._hide(promo_id)
+
+    def _tick(self) -> datetime:
+        now = current_time()
+        for promo_id in self._wheel.advance(now):
+            self._refresh(promo_id, now)
+        return now
+
+    def upsert(self, promo: Promo) -> None:
+        """
+        Добавление или обновление промокода в индексе
+        """
+        promo_id = str(promo.id)
+        now = current_time()
+        if promo_id in self._entries:
+            self._hide(promo_id)
+            del self._entries[promo_id]
+
+        if not promo.active or (promo.active_until is not None and promo.active_until < now):
+            self._usage.pop(promo_id, None)
+            return
+
+        country = (promo.target or {}).get("country")
+        entry = IndexedPromo(
+            id=promo_id,
+            sort_key=(promo.created_at or datetime.min, promo_id),
+            country=country.lower() if country else None,
+            active_from=promo.active_from,
+            active_until=promo.active_until,
+            capacity=promo_capacity(promo),
+            card=promo_card(promo),
+        )
+        self._entries[promo_id] = entry
+
+        # Таймеры открытия и окончания периода активности; лишние срабатывания безопасны
+        if entry.active_from is not None and entry.active_from > now:
+            self._wheel.schedule(promo_id, entry.active_from)
+        if entry.active_until is not None:
+            self._wheel.schedule(promo_id, entry.active_until + timedelta(seconds=self._wheel.resolution))
+        self._refresh(promo_id, now)
+
+    def set_usage(self, promo_id, used: int) -> None:
+        promo_id = str(promo_id)
+        if promo_id not in self._entries:
+            return
+        self._usage[promo_id] = used
+        self._refresh(promo_id, current_time())
+
+    def record_activation(self, promo_id) -> None:
+        """
+        Учет активации промокода, выполненной в этом воркере
+        """
+        promo_id = str(promo_id)
+        self.set_usage(promo_id, self._usage.get(promo_id, 0) + 1)
+
+    def page(self, country: str | None, limit: int, after: tuple[datetime, str] | None) -> tuple[list[dict], int | None, tuple | None]:
+        """
+        Страница ленты по убыванию (created_at, id). Возвращает карточки, общее количество и ключ последней записи,
+        если есть следующая страница. Как и в SQL-запросе ленты, на страницах по курсору количество не возвращается (None)
+        """
+        self._tick()
+        keys = self._by_country.get(country.lower(), []) if country else self._visible
+        end = bisect_left(keys, after) if after is not None else len(keys)
+        start = max(end - limit, 0)
+        page_keys = keys[start:end][::-1]
+        cards = [self._entries[promo_id].card for _, promo_id in page_keys]
+        next_key = page_keys[-1] if start > 0 and page_keys else None
+        return cards, len(keys) if after is None else None, next_key
+
+    async def _load_usage(self, db: AsyncSession, promo_ids) -> None:
+        if not promo_ids:
+            return
+        rows = (await db.execute(
+            select(PromoActivation.promo_id, func.count())
+            .where(PromoActivation.promo_id.in_(promo_ids))
+            .group_by(PromoActivation.promo_id)
+        )).all()
+        counts = {str(promo_id): used for promo_id, used in rows}
+        for promo_id in promo_ids:
+            self.set_usage(promo_id, counts.get(str(promo_id), 0))
+
+    async def load(self, db: AsyncSession) -> None:
+        """
+        Полная загрузка индекса из базы
+        """
+        now = current_time()
+        promos = (await db.execute(
+            select(Promo).where(
+                Promo.active == True,
+                (Promo.active_until.is_(None)) | (Promo.active_until >= now),
+            )
+        )).scalars().all()
+        for promo in promos:
+            self.upsert(promo)
+        await self._load_usage(db, [promo.id for promo in promos])
+
+        self._updated_watermark = (await db.execute(select(func.max(Promo.updated_at)))).scalar()
+        self._activated_watermark = (await db.execute(select(func.max(PromoActivation.activated_at)))).scalar()
+        self.ready = True
+
+    async def poll(self, db: AsyncSession) -> None:
+        """
+        Дозагрузка изменений промокодов и активаций с прошлого опроса.
+        Опрос захватывает окно перекрытия, чтобы не пропустить поздно закоммиченные изменения
+        """
+        query = select(Promo)
+        if self._updated_watermark is not None:
+            query = query.where(Promo.updated_at >= self._updated_watermark - self.overlap)
+        promos = (await db.execute(query)).scalars().all()
+        for promo in promos:
+            self.upsert(promo)
+            if promo.updated_at and (self._updated_watermark is None or promo.updated_at > self._updated_watermark):
+                self._updated_watermark = promo.updated_at
+
+        query = select(PromoActivation.promo_id, func.max(PromoActivation.activated_at)).group_by(PromoActivation.promo_id)
+        if self._activated_watermark is not None:
+            query = query.where(PromoActivation.activated_at >= self._activated_watermark - self.overlap)
+        rows = (await db.execute(query)).all()
+        for _, activated_at in rows:
+            if activated_at and (self._activated_watermark is None or activated_at > self._activated_watermark):
+                self._activated_watermark = activated_at
+
+        # Новые записи индекса и промокоды с новыми активациями получают точные счетчики
+        changed = {str(promo.id) for promo in promos} | {str(promo_id) for promo_id, _ in rows}
+        await self._load_usage(db, [promo_id for promo_id in changed if promo_id in self._entries])
+        self._tick()
+
+    async def run(self, session_maker: async_sessionmaker) -> None:
+        """
+        Фоновая задача: начальная загрузка и периодический опрос изменений
+        """
+        if not self.enabled:
+            return
+        while True:
+            try:
+                async with session_maker() as db:
+                    if self.ready:
+                        await self.poll(db)
+                    else:
+                        await self.load(db)
+            except Exception:
+                logger.exception("Active promo index refresh failed")
+            await asyncio.sleep(self.poll_interval)
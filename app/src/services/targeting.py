@@ -0,0 +1,74 @@
+from typing import NamedTuple
+
+from src.core.cache import TTLCache
+from src.core.config import settings
+from src.models.promo import Promo
+
+
+class UserProfile(NamedTuple):
+    """
+    Компактный снимок профиля пользователя для проверки таргетинга
+    """
+    id: str
+    email: str
+    country: str | None
+    age: int | None
+
+    @classmethod
+    def from_profile(cls, profile: dict) -> "UserProfile":
+        """
+        Построение снимка из словаря профиля (см. UserService.profile_get)
+        """
+        other = profile.get("other") or {}
+        country = other.get("country")
+        age = other.get("age")
+        return cls(
+            id=str(profile["id"]),
+            email=profile["email"],
+            country=country.lower() if isinstance(country, str) else None,
+            age=age if isinstance(age, int) else None,
+        )
+
+
+class TargetingPredicate:
+    """
+    Скомпилированные условия таргетинга промокода
+    """
+    __slots__ = ("country", "age_from", "age_until")
+
+    def __init__(self, target: dict | None):
+        target = target or {}
+        country = target.get("country")
+        self.country = country.lower() if country else None
+        self.age_from = target.get("age_from")
+        self.age_until = target.get("age_until")
+        # Категории (target.categories) описывают сам промокод и на выбор пользователей не влияют
+
+    def matches(self, profile: UserProfile) -> bool:
+        """
+        Проверка соответствия пользователя условиям таргетинга
+        """
+        if self.country is not None and profile.country != self.country:
+            return False
+        if self.age_from is not None and (profile.age is None or profile.age < self.age_from):
+            return False
+        if self.age_until is not None and (profile.age is None or profile.age > self.age_until):
+            return False
+        return True
+
+
+class TargetingService:
+    """
+    Компиляция таргетинга промокодов с кешированием по id и версии промокода
+    """
+
+    def __init__(self):
+        self._cache = TTLCache(maxsize=settings.targeting.cache_size, ttl=settings.targeting.cache_ttl)
+
+    def compile(self, promo: Promo) -> TargetingPredicate:
+        key = (str(promo.id), promo.updated_at)
+        predicate = self._cache.get(key)
+        if predicate is None:
+            predicate = TargetingPredicate(promo.target)
+            self._cache.set(key, predicate)
+        return predicate
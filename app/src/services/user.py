@@ -5,16 +5,23 @@ from datetime import datetime, timedelta
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy.exc import IntegrityError
+from redis.asyncio import Redis
 
 from fastapi import HTTPException, status
 
 from src.core.config import settings
+from src.models.promo import Comment
 from src.models.user import User
+from src.services.etag import EtagService
+from src.services.targeting import UserProfile
+from src.services.profile_cache import ProfileCache
 
+profile_cache = ProfileCache()
+etag_service = EtagService()
 
 class UserService:
 
-    async def sign_up(self, body: dict, db: AsyncSession) -> dict:
+    async def sign_up(self, body: dict, db: AsyncSession, redis: Redis) -> dict:
         """
         Регистрация нового пользователя
         POST /user/auth/sign-up
@@ -48,6 +55,7 @@ class UserService:
             )
             db.add(user)
             await db.commit()
+            await profile_cache.invalidate(user.id, redis)
 
             token = jwt.encode(
                 {"sub": str(user.id), "exp": datetime.utcnow() + timedelta(minutes=settings.jwt.token_expire_time)},
@@ -134,27 +142,33 @@ class UserService:
                 detail="Invalid token."
             )
 
-    async def profile_get(self, user_id: str, db: AsyncSession) -> dict:
+    async def profile_get(self, user_id: str, db: AsyncSession, redis: Redis) -> dict:
         """
         Получение информации о своем профиле
         GET /user/profile
         """
+        profile = await profile_cache.get(user_id, redis)
+        if profile is not None:
+            return profile
+
+        # Поколение запоминается до чтения: профиль, измененный во время запроса, не попадет в кеш
+        generation = await profile_cache.generation(user_id, redis)
         user = await db.get(User, user_id)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="User not found."
             )
-        return {
+        return await profile_cache.set(user_id, {
             "id": str(user.id),
             "email": user.email,
             "name": user.name,
             "surname": user.surname,
             "created_at": user.created_at,
             "other": user.other if isinstance(user.other, dict) else None
-        }
+        }, generation, redis)
 
-    async def profile_update(self, user_id: str, body: dict, db: AsyncSession) -> dict:
+    async def profile_update(self, user_id: str, body: dict, db: AsyncSession, redis: Redis) -> dict:
         """
         Изменение пользовательских настроек
         PATCH /user/profile
@@ -172,34 +186,18 @@ class UserService:
 
         user.updated_at = datetime.utcnow()
         await db.commit()
+        await profile_cache.invalidate(user_id, redis)
+
+        # Имя автора входит в ETag страниц комментариев: сбрасываются ETag промокодов с комментариями пользователя
+        if "name" in body or "surname" in body:
+            promo_ids = (await db.execute(
+                select(Comment.promo_id).where(Comment.user_id == user_id).distinct()
+            )).scalars().all()
+            await etag_service.invalidate(redis, promo_ids)
         return {"id": user.id, "email": user.email, "name": user.name, "updated_at": user.updated_at}
 
-    async def matches_targeting(self, user_id: str, targeting: dict, db: AsyncSession) -> bool:
+    async def profile_snapshot(self, user_id: str, db: AsyncSession, redis: Redis) -> UserProfile:
         """
-        Проверяет соответствие пользователя условиям таргетинга промокода
+        Компактный снимок профиля пользователя для проверки таргетинга и антифрода
         """
-        # Получаем данные пользователя (пример: из базы данных или внешнего сервиса)
-        user = await self.profile_get(user_id, db)
-
-        if not user:
-            return False
-
-        # Пример таргетинга по стране
-        if "country" in targeting:
-            if user.country not in targeting["country"]:
-                return False
-
-        # Пример таргетинга по возрасту
-        if "age_min" in targeting or "age_max" in targeting:
-            if "age_min" in targeting and user.age < targeting["age_min"]:
-                return False
-            if "age_max" in targeting and user.age > targeting["age_max"]:
-                return False
-
-        # Пример таргетинга по языку
-        if "language" in targeting:
-            if user.language not in targeting["language"]:
-                return False
-
-        # Добавьте дополнительные проверки таргетинга, если требуется
-        return True
\ No newline at end of file
+        return UserProfile.from_profile(await self.profile_get(user_id, db, redis))
@@ -1,3 +1,14 @@
+-- Итоговая схема после всех миграций (src/migrations). Базу следует создавать
+-- командой `python -m src.migrations upgrade`; файл служит справочником.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE TABLE schema_version (
+    version INTEGER PRIMARY KEY,
+    description VARCHAR NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
 CREATE TABLE companies (
     id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
     email VARCHAR(255) UNIQUE NOT NULL,
@@ -11,9 +22,11 @@ CREATE TABLE users (
     id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
     email VARCHAR(255) UNIQUE NOT NULL,
     password VARCHAR(255) NOT NULL,
-    name VARCHAR(100),
+    name VARCHAR(255),
+    surname VARCHAR(255),
     created_at TIMESTAMP DEFAULT NOW(),
-    updated_at TIMESTAMP DEFAULT NOW()
+    updated_at TIMESTAMP DEFAULT NOW(),
+    other JSONB
 );
 
 CREATE TABLE promos (
@@ -21,18 +34,37 @@ CREATE TABLE promos (
     company_id UUID NOT NULL REFERENCES companies(id) ON DELETE CASCADE,
     mode VARCHAR(10) NOT NULL,
     promo_common VARCHAR(50),
-    promo_unique JSON,
+    promo_unique JSONB,
     description VARCHAR NOT NULL,
     image_url VARCHAR,
-    target JSONB,  -- Изменено на JSONB
-    max_count INT NOT NULL,
+    target JSONB,
+    max_count INTEGER NOT NULL,
     active_from TIMESTAMP,
     active_until TIMESTAMP,
     active BOOLEAN DEFAULT TRUE,
     created_at TIMESTAMP DEFAULT NOW(),
-    updated_at TIMESTAMP DEFAULT NOW()
+    updated_at TIMESTAMP DEFAULT NOW(),
+    search_vector TSVECTOR GENERATED ALWAYS AS (
+        to_tsvector('simple', coalesce(description, '') || ' ' || coalesce(promo_common, ''))
+    ) STORED,
+    target_country VARCHAR GENERATED ALWAYS AS (lower(target ->> 'country')) STORED,
+    code_count INTEGER GENERATED ALWAYS AS (coalesce(jsonb_array_length(promo_unique), 0)) STORED
 );
 
+CREATE INDEX ix_promos_created_at_id ON promos (created_at, id);
+CREATE INDEX ix_promos_updated_at ON promos (updated_at);
+CREATE INDEX ix_promos_search_vector ON promos USING gin (search_vector);
+CREATE INDEX ix_promos_description_trgm ON promos USING gin (description gin_trgm_ops);
+CREATE INDEX ix_promos_promo_common_trgm ON promos USING gin (promo_common gin_trgm_ops);
+CREATE INDEX ix_promos_company_id_created_at_id ON promos (company_id, created_at, id);
+CREATE INDEX ix_promos_company_id_active_from_id ON promos (company_id, active_from, id);
+CREATE INDEX ix_promos_company_id_active_until_id ON promos (company_id, active_until, id);
+CREATE INDEX ix_promos_company_id_target_country ON promos (company_id, target_country);
+CREATE INDEX ix_promos_target_country_created_at_id ON promos (target_country, created_at, id);
+CREATE INDEX ix_promos_target ON promos USING gin (target jsonb_path_ops);
+CREATE INDEX ix_promos_active_from_active ON promos (active_from) WHERE active;
+CREATE INDEX ix_promos_target_country_active_from_active ON promos (target_country, active_from) WHERE active;
+
 CREATE TABLE comments (
     id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
     promo_id UUID NOT NULL REFERENCES promos(id) ON DELETE CASCADE,
@@ -42,6 +74,8 @@ CREATE TABLE comments (
     updated_at TIMESTAMP DEFAULT NOW()
 );
 
+CREATE INDEX ix_comments_promo_id_created_at_id ON comments (promo_id, created_at DESC, id DESC);
+
 CREATE TABLE likes (
     id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
     promo_id UUID NOT NULL REFERENCES promos(id) ON DELETE CASCADE,
@@ -49,6 +83,8 @@ CREATE TABLE likes (
     created_at TIMESTAMP DEFAULT NOW()
 );
 
+CREATE UNIQUE INDEX ux_likes_promo_id_user_id ON likes (promo_id, user_id);
+
 CREATE TABLE promo_activations (
     id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
     promo_id UUID NOT NULL REFERENCES promos(id) ON DELETE CASCADE,
@@ -56,3 +92,36 @@ CREATE TABLE promo_activations (
     activation_value VARCHAR(50),
     activated_at TIMESTAMP DEFAULT NOW()
 );
+
+CREATE INDEX ix_promo_activations_activated_at ON promo_activations (activated_at);
+CREATE INDEX ix_promo_activations_promo_id ON promo_activations (promo_id);
+CREATE INDEX ix_promo_activations_user_id_promo_id ON promo_activations (user_id, promo_id);
+
+CREATE TABLE promo_codes (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    promo_id UUID NOT NULL REFERENCES promos(id) ON DELETE CASCADE,
+    value VARCHAR(50) NOT NULL,
+    claimed_by UUID REFERENCES users(id) ON DELETE CASCADE,
+    claimed_at TIMESTAMP
+);
+
+CREATE INDEX ix_promo_codes_promo_id_free ON promo_codes (promo_id) WHERE claimed_by IS NULL;
+
+CREATE TABLE promo_counters (
+    promo_id UUID PRIMARY KEY REFERENCES promos(id) ON DELETE CASCADE,
+    like_count INTEGER NOT NULL DEFAULT 0,
+    comment_count INTEGER NOT NULL DEFAULT 0,
+    activation_count INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT INTO schema_version (version, description) VALUES
+    (1, 'baseline schema'),
+    (2, 'promo search_vector, target_country and promo_codes'),
+    (3, 'hot path indexes'),
+    (4, 'promo counters'),
+    (5, 'unique likes per user'),
+    (6, 'promo activations by user index'),
+    (7, 'comments page index'),
+    (8, 'promo activations by promo index'),
+    (9, 'promo code count'),
+    (10, 'feed opening indexes');
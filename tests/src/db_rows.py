@@ -0,0 +1,58 @@
+import asyncio
+
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.sql import text
+
+from config import settings
+
+
+def check_likes(response, promo_id: str, count: int):
+    """
+    Проверка лайков промокода, записанных в базу (для verify_response_with в Tavern):
+    количество строк likes и значение счетчика promo_counters.like_count
+    """
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(_check_likes(promo_id, count))
+
+
+async def _check_likes(promo_id: str, count: int):
+    engine = create_async_engine(settings.db.dsn, future=True)
+    try:
+        async with engine.connect() as conn:
+            rows = (await conn.execute(
+                text("SELECT count(*) FROM likes WHERE promo_id = :promo_id"), {"promo_id": promo_id}
+            )).scalar()
+            assert rows == count, f"{rows} likes in the database, expected {count}"
+
+            counter = (await conn.execute(
+                text("SELECT like_count FROM promo_counters WHERE promo_id = :promo_id"), {"promo_id": promo_id}
+            )).scalar()
+            assert (counter or 0) == count, f"like_count counter is {counter}, expected {count}"
+    finally:
+        await engine.dispose()
+
+
+def check_activations(response, promo_id: str, count: int):
+    """
+    Проверка активаций промокода, записанных в базу (для verify_response_with в Tavern):
+    количество строк promo_activations и значение счетчика promo_counters.activation_count
+    """
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(_check_activations(promo_id, count))
+
+
+async def _check_activations(promo_id: str, count: int):
+    engine = create_async_engine(settings.db.dsn, future=True)
+    try:
+        async with engine.connect() as conn:
+            rows = (await conn.execute(
+                text("SELECT count(*) FROM promo_activations WHERE promo_id = :promo_id"), {"promo_id": promo_id}
+            )).scalar()
+            assert rows == count, f"{rows} activations in the database, expected {count}"
+
+            counter = (await conn.execute(
+                text("SELECT activation_count FROM promo_counters WHERE promo_id = :promo_id"), {"promo_id": promo_id}
+            )).scalar()
+            assert (counter or 0) == count, f"activation_count counter is {counter}, expected {count}"
+    finally:
+        await engine.dispose()
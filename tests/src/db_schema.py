@@ -0,0 +1,39 @@
+import asyncio
+
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.sql import text
+
+from config import settings
+
+
+def check_schema(response, version: int, tables: list, indexes: list):
+    """
+    Проверка схемы базы после миграций (для verify_response_with в Tavern):
+    версия схемы, наличие таблиц и валидных индексов
+    """
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(_check_schema(version, tables, indexes))
+
+
+async def _check_schema(version: int, tables: list, indexes: list):
+    engine = create_async_engine(settings.db.dsn, future=True)
+    try:
+        async with engine.connect() as conn:
+            current = (await conn.execute(text("SELECT max(version) FROM schema_version"))).scalar()
+            assert current == version, f"Schema version {current}, expected {version}"
+
+            for table in tables:
+                exists = (await conn.execute(text("SELECT to_regclass(:name)"), {"name": table})).scalar()
+                assert exists is not None, f"Table {table} is missing"
+
+            for index in indexes:
+                valid = (await conn.execute(
+                    text(
+                        "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                        "WHERE c.relname = :name"
+                    ),
+                    {"name": index},
+                )).scalar()
+                assert valid, f"Index {index} is missing or invalid"
+    finally:
+        await engine.dispose()
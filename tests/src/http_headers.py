@@ -0,0 +1,6 @@
+def check_absent(response, headers: list):
+    """
+    Проверка отсутствия заголовков в ответе (для verify_response_with в Tavern)
+    """
+    present = [name for name in headers if name in response.headers]
+    assert not present, f"Unexpected headers in response: {', '.join(present)}"
@@ -0,0 +1,32 @@
+import json
+from datetime import datetime, timedelta
+
+import redis
+
+from config import settings
+
+
+def _client() -> redis.Redis:
+    return redis.Redis(host=settings.redis.host, port=settings.redis.port)
+
+
+def set_antifraud_verdict(response, user_email: str, promo_id: str, ok: bool, seconds: int):
+    """
+    Сохранение вердикта антифрода в кеш Redis (для verify_response_with в Tavern).
+    cache_until отстоит от текущего времени на seconds и может быть в прошлом
+    """
+    cache_until = datetime.utcnow() + timedelta(seconds=seconds)
+    with _client() as client:
+        client.set(
+            f"antifraud:{user_email}:{promo_id}",
+            json.dumps({"ok": ok, "cache_until": cache_until.strftime("%Y-%m-%dT%H:%M:%S.%f")}),
+            ex=3600,
+        )
+
+
+def delete_antifraud_verdict(response, user_email: str, promo_id: str):
+    """
+    Удаление вердикта антифрода из кеша Redis (для verify_response_with в Tavern)
+    """
+    with _client() as client:
+        client.delete(f"antifraud:{user_email}:{promo_id}")